@@ -2,13 +2,31 @@
 # -*- coding: utf-8 -*-
 #name:error
 
-import json, logging, inspect, functools
+import json, logging, inspect, functools, base64
+
+
+# 分页游标：把(方向, 排序列的值, 主键)编码为不透明的字符串
+def encode_cursor(direction, value, pk):
+	return base64.urlsafe_b64encode(json.dumps([direction, value, pk]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+	try:
+		direction, value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+	except (ValueError, TypeError):
+		raise APIValueError('cursor', 'Invalid cursor.')
+	if direction not in ('after', 'before'):
+		raise APIValueError('cursor', 'Invalid cursor.')
+	return direction, (value, pk)
 
 
 # 分页(显示blog的功能)
+# 有两种模式：
+#     页码模式：用offset, limit查询，Page(num, page_index)
+#     游标模式：用keyset查询，Page(num, page_size=n, cursor=decode_cursor(token))，深翻页不会变慢
+# 取到的记录交给paginate()生成next_cursor/prev_cursor
 class Page(object):
 	"""docstring for Page"""
-	def __init__(self, item_count, page_index=1, page_size=10):
+	def __init__(self, item_count, page_index=1, page_size=10, cursor=None):
 		self.item_count = item_count
 		self.page_size = page_size
 		self.page_count = item_count // page_size + (1 if item_count % page_size > 0 else 0)
@@ -22,9 +40,36 @@ class Page(object):
 			self.limit = self.page_size
 		self.has_next = self.page_index < self.page_count
 		self.has_previous = self.page_index > 1
+		self.next_cursor = None
+		self.prev_cursor = None
+		self.cursor = None
+		if cursor and item_count > 0:
+			self.cursor = cursor
+			self.offset = 0
+			self.limit = self.page_size
+
+	# 根据取到的记录生成前后页的游标，返回本页的记录
+	def paginate(self, items, key, pk='id'):
+		items = list(items)
+		if self.cursor is not None:
+			direction, _ = self.cursor
+			more = len(items) > self.limit
+			if direction == 'after':
+				items = items[:self.limit]
+				self.has_next, self.has_previous = more, True
+			else:
+				items = items[-self.limit:] if more else items
+				self.has_next, self.has_previous = True, more
+		if items:
+			first, last = items[0], items[-1]
+			if self.has_next:
+				self.next_cursor = encode_cursor('after', last[key], last[pk])
+			if self.has_previous:
+				self.prev_cursor = encode_cursor('before', first[key], first[pk])
+		return items
 
 	def __str__(self):
-		return 'item_count: %s, page_count: %s, page_index: %s, page_size: %s, offset: %s, limit: %s' % (self.item_count, self.page_count, self.page_index, self.page_size, self.offset, self.limit)
+		return 'item_count: %s, page_count: %s, page_index: %s, page_size: %s, offset: %s, limit: %s, cursor: %s' % (self.item_count, self.page_count, self.page_index, self.page_size, self.offset, self.limit, self.cursor)
 		
 	__repr__ = __str__
 
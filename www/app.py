@@ -13,6 +13,7 @@ from jinja2 import Environment, FileSystemLoader
 import orm
 from coroweb import add_routes, add_static
 
+from config import configs
 from handlers import cookie2user, COOKIR_NAME
 # middleware是一种拦截器，一个URL在被某个函数处理前，可以经过一系列的middleware的处理。
 # 添加middleware的时候已经作了倒序处理
@@ -29,6 +30,34 @@ def logger_factory(app, handler):
 		return (yield from handler(request))
 	return logger
 
+# 合并同一请求内并发的Model.find(pk)查询
+@asyncio.coroutine
+def loader_factory(app, handler):
+	@asyncio.coroutine
+	def loader(request):
+		with orm.loader_scope():
+			return (yield from handler(request))
+	return loader
+
+# 同一请求内同一条记录只加载一次，返回同一个Model对象
+@asyncio.coroutine
+def identity_factory(app, handler):
+	@asyncio.coroutine
+	def identity(request):
+		with orm.identity_scope():
+			return (yield from handler(request))
+	return identity
+
+# 请求中的所有语句共用一个连接(配置db.request_connection开启)
+# 放在response_factory之后，处理函数返回后就归还连接，渲染模板时不占用
+@asyncio.coroutine
+def connection_factory(app, handler):
+	@asyncio.coroutine
+	def connection(request):
+		with orm.connection_scope():
+			return (yield from handler(request))
+	return connection
+
 # 用户验证处理
 @asyncio.coroutine
 def auth_factory(app, handler):
@@ -47,6 +76,12 @@ def auth_factory(app, handler):
 		return (yield from handler(request))
 	return auth
 
+# 对象转换为JSON；只读的行对象(findAll(lightweight=True))没有__dict__
+def json_default(o):
+	if isinstance(o, orm.Row):
+		return o._asdict()
+	return o.__dict__
+
 # 把返回值转换为web.Response对象再返回，以保证满足aiohttp的要求
 @asyncio.coroutine
 def response_factory(app, handler):
@@ -70,7 +105,7 @@ def response_factory(app, handler):
 		if isinstance(r, dict):
 			template = r.get('__template__')
 			if template is None:
-				resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
+				resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=json_default).encode('utf-8'))
 				resp.content_type = 'application/json;charset=utf-8'
 				return resp
 			else:
@@ -179,8 +214,8 @@ def init_jinja2(app, **kw):
 
 @asyncio.coroutine
 def init(loop):
-	yield from orm.create_pool(loop=loop, user='root', password='root', db='combat')
-	app = web.Application(loop=loop, middlewares=[logger_factory, auth_factory, response_factory])
+	yield from orm.create_pool(loop=loop, **configs.db)
+	app = web.Application(loop=loop, middlewares=[logger_factory, loader_factory, identity_factory, auth_factory, response_factory, connection_factory])
 	init_jinja2(app, filters=dict(datetime=datetime_filter))
 	add_routes(app, 'handlers')
 	add_static(app)
@@ -195,7 +230,13 @@ loop = asyncio.get_event_loop(); # 获取当前上下文的事件循环,创建
 # task对象是Future类的子类，保存了协程运行后的状态，用于未来获取协程的结果
 loop.run_until_complete(init(loop)) 
 
-loop.run_forever();
+try:
+	loop.run_forever();
+except KeyboardInterrupt:
+	pass
+finally:
+	# 写入还在队列中的数据并关闭连接池
+	loop.run_until_complete(orm.close_pool())
 
 # ********************************************
 # make_handler():创建用于处理请求的http协议工厂
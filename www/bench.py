@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# name: 性能测试
+
+'''
+ORM的性能测试，使用临时的SQLite数据库，不需要MySQL
+
+    python3 bench.py rows [n]    对比findAll返回Model(dict)和只读行对象(lightweight=True)的内存和速度
+    python3 bench.py args [n]    对比save/update/remove逐列getValueOrDefault和预先生成的取参数函数(__args__)，每条记录的耗时
+'''
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+import tracemalloc
+
+import orm
+from models import Blog
+
+
+@asyncio.coroutine
+def setup(loop, n):
+    path = tempfile.mktemp(suffix='.db')
+    # 测的是查询本身，不使用结果缓存
+    Blog.__result_cache__ = None
+    yield from orm.create_pool(loop=loop, backend='sqlite', db=path)
+    for sql in Blog.ddl():
+        yield from orm.execute(sql, [])
+    summary = 'Lorem ipsum dolor sit amet, consectetur adipisicing elit.'
+    yield from Blog.save_many([Blog(user_id='u%s' % (i % 10), user_name='user', user_image='about:blank',
+                                    name='blog %s' % i, summary=summary, content='...') for i in range(n)])
+    return path
+
+
+# 返回(每次的平均耗时, 结果占用的内存)
+@asyncio.coroutine
+def measure(rounds, **kw):
+    yield from Blog.findAll(**kw)
+    start = time.perf_counter()
+    for i in range(rounds):
+        yield from Blog.findAll(**kw)
+    elapsed = (time.perf_counter() - start) / rounds
+    tracemalloc.start()
+    rs = yield from Blog.findAll(**kw)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rs
+    return elapsed, size
+
+
+@asyncio.coroutine
+def bench_rows(loop, n):
+    path = yield from setup(loop, n)
+    try:
+        rounds = max(1, 100000 // n)
+        print('%d rows, %d rounds' % (n, rounds))
+        print('%-12s %12s %12s %12s' % ('path', 'ms/query', 'rows/s', 'memory(KB)'))
+        for label, kw in (('dict', dict()), ('lightweight', dict(lightweight=True))):
+            elapsed, size = yield from measure(rounds, **kw)
+            print('%-12s %12.2f %12.0f %12.1f' % (label, elapsed * 1000, n / elapsed, size / 1024))
+    finally:
+        yield from orm.close_pool()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def new_blogs(n):
+    return [Blog(user_id='u', user_name='user', user_image='about:blank', name='blog', summary='...', content='...') for i in range(n)]
+
+
+# 原来的实现：逐列getattr，每次判断默认值是否callable
+def insert_args(obj):
+    args = list(map(obj.getValueOrDefault, obj.__fields__))
+    args.append(obj.getValueOrDefault(obj.__primary_key__))
+    return args
+
+
+def update_args(obj):
+    args = list(map(obj.getValue, obj.__fields__))
+    args.append(obj.getValue(obj.__primary_key__))
+    return args
+
+
+def bench_args(n):
+    print('%d rows' % n)
+    print('%-8s %14s %14s %8s' % ('args', 'getattr(us)', '__args__(us)', 'speedup'))
+    for label, old, new in (('insert', insert_args, Blog.__args__['insert']), ('update', update_args, Blog.__args__['update'])):
+        result = []
+        for fn in (old, new):
+            # 新建的对象没有id和create_at，insert时需要使用默认值
+            objs = new_blogs(n)
+            start = time.perf_counter()
+            for obj in objs:
+                fn(obj)
+            result.append((time.perf_counter() - start) / n * 1e6)
+        print('%-8s %14.3f %14.3f %7.1fx' % (label, result[0], result[1], result[0] / result[1]))
+
+
+@asyncio.coroutine
+def main(loop, argv):
+    if not argv or argv[0] not in ('rows', 'args'):
+        print(__doc__)
+        return
+    if argv[0] == 'args':
+        bench_args(int(argv[1]) if len(argv) > 1 else 100000)
+    else:
+        yield from bench_rows(loop, int(argv[1]) if len(argv) > 1 else 1000)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, sys.argv[1:]))
@@ -6,11 +6,17 @@
 configs = {
     'debug': True,
     'db': {
+        # 'mysql'或'sqlite'(db为数据库文件的路径)
+        'backend': 'mysql',
         'host': '127.0.0.1',
         'post': 3306,
         'user': 'root',
         'password': 'root',
-        'db': 'combat'
+        'db': 'combat',
+        # 使用write-behind队列批量插入的表，如['comments']
+        'write_behind': [],
+        # 每个请求只从连接池取一次连接，请求中的所有语句共用(读也走主库)
+        'request_connection': False
     },
     'session': {
         'secret': 'Combat'
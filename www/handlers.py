@@ -15,8 +15,9 @@ import asyncio
 import markdown2
 
 from coroweb import get, post
-from apis import Page, APIValueError, APIResourceNotFoundError
+from apis import APIValueError, APIResourceNotFoundError, encode_cursor, decode_cursor
 
+import orm
 from models import User, Comment, Blog, next_id
 from config import configs
 
@@ -94,18 +95,43 @@ def signout(request):
 	logging.info('user signed out.')
 	return r
 
+# 日志详情页每次显示的评论数，更多的评论用next_cursor从/api/blogs/{id}/comments取
+COMMENTS_PAGE_SIZE = 20
+_COMMENT_COLUMNS = ('user_id', 'user_name', 'user_image', 'content', 'html_content', 'create_at')
+
+# 一页评论(按时间倒序)，cursor为上一页的next_cursor
+#     @return (comments, next_cursor)，没有更多评论时next_cursor为None
+@asyncio.coroutine
+def blog_comments(blog_id, cursor=None):
+	kw = dict(limit=COMMENTS_PAGE_SIZE + 1)
+	if cursor:
+		direction, key = decode_cursor(cursor)
+		if direction != 'after':
+			raise APIValueError('cursor', 'Invalid cursor.')
+		kw['after'] = key
+	comments = yield from Comment.findAll('`blog_id`=?', [blog_id], orderBy='create_at desc', columns=_COMMENT_COLUMNS, lightweight=True, **kw)
+	next_cursor = None
+	if len(comments) > COMMENTS_PAGE_SIZE:
+		comments = comments[:COMMENTS_PAGE_SIZE]
+		next_cursor = encode_cursor('after', comments[-1].create_at, comments[-1].id)
+	for c in comments:
+		# 没有预先生成HTML的旧评论
+		if c.html_content is None:
+			c.html_content = text2html(c.content)
+	return comments, next_cursor
+
 # 日志详情
 @get('/blog/{id}')
 def get_blog(id):
-	blog = yield from Blog.find(id)
-	comments = yield from Comment.findAll('blog_id=?', [id], orderBy='create_at desc')
-	for c in comments:
-		c.html_content = text2html(c.content)
+	blog, (comments, next_cursor) = yield from asyncio.gather(Blog.find(id), blog_comments(id))
+	if blog is None:
+		raise APIResourceNotFoundError('Blog')
 	blog.html_content = markdown2.markdown(blog.content)
 	return {
 		'__template__': 'blog.html',
 		'blog': blog,
-		'comments': comments
+		'comments': comments,
+		'next_cursor': next_cursor
 	}
 
 # *****************end:用户浏览页面********************************
@@ -165,13 +191,8 @@ def manage_users(*, page='1'):
 # *****************start:后端api********************************
 # 获取日志
 @get('/api/blogs')
-def api_blogs(*, page='1'):
-	page_index = get_page_index(page)
-	num = yield from Blog.findNumber('count(id)')
-	p = Page(num, page_index)
-	if num == 0:
-		return dict(page=p, blogs=())
-	blogs = yield from Blog.findAll(orderBy='create_at desc', limit=(p.offect, p.limit))
+def api_blogs(*, page='1', cursor=None):
+	p, blogs = yield from Blog.findPage(get_page_index(page), cursor=cursor, orderBy='create_at desc', lightweight=True)
 	return dict(page=p, blogs=blogs)
 
 @get('/api/blogs/{id}')
@@ -215,20 +236,32 @@ def api_update_blog(id, request, *, name, summary, content):
 def api_delete_blog(request, *, id):
 	check_admin(request)
 	blog = yield from Blog.find(id)
-	yield from blog.remove()
+	if blog is None:
+		raise APIResourceNotFoundError('Blog')
+	# 日志和它的评论在同一个事务中删除
+	tx = orm.transaction()
+	yield from tx.begin()
+	try:
+		yield from Comment.removeAll('`blog_id`=?', [id])
+		yield from blog.remove()
+	except BaseException:
+		yield from tx.rollback()
+		raise
+	yield from tx.commit()
 	return dict(id=id)
 
 # 获取评论
 @get('/api/comments')
-def api_comments(*, page='1'):
-	page_index = get_page_index(page)
-	num = yield from Comment.findNumber('count(id)')
-	p = Page(num, page_index)
-	if num:
-		return dict(page=p, comments=())
-	comments = yield from Comment.findAll(orderBy='create_at desc', limit=(p.offset, p.limit))
+def api_comments(*, page='1', cursor=None):
+	p, comments = yield from Comment.findPage(get_page_index(page), cursor=cursor, orderBy='create_at desc', lightweight=True)
 	return dict(page=p, comments=comments)
 
+# 日志的评论，按时间倒序分页
+@get('/api/blogs/{id}/comments')
+def api_blog_comments(id, *, cursor=None):
+	comments, next_cursor = yield from blog_comments(id, cursor)
+	return dict(comments=comments, next_cursor=next_cursor)
+
 # 创建评论
 @post('/api/blogs/{id}/comments')
 def api_create_comment(id, request, *, content):
@@ -240,7 +273,7 @@ def api_create_comment(id, request, *, content):
 	blog = yield from Blog.find(id)
 	if blog is None:
 		raise APIResourceNotFoundError('Blog')
-	comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
+	comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip(), html_content=text2html(content.strip()))
 	yield from comment.save()
 	return comment
 
@@ -275,23 +308,15 @@ def api_register_user(*, email, name, passwd):
     r = web.Response()
     r.set_cookie(COOKIR_NAME, user2cookie(
         user, 86400), max_age=86400, httponly=True)
-    user.passwd = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = json.dumps(masked_user(user), ensure_ascii=False).encode('utf-8')
     return r
 
 # 获取用户
 @get('/api/users')
-def api_get_users(*, page='1'):
-	page_index = get_page_index(page)
-	num = yield from User.findNumber('count(id)')
-	p = Page(num, page_index)
-	if num == 0:
-		return dict(page=p, users=())
-	users = yield from User.findAll(orderBy='create_at desc',limit=(p.offset, p.limit))
-	for u in users:
-		u.password = '******'
-	return dict(page=p, users=users)
+def api_get_users(*, page='1', cursor=None):
+	p, users = yield from User.findPage(get_page_index(page), cursor=cursor, orderBy='create_at desc')
+	return dict(page=p, users=[masked_user(u) for u in users])
 
 # *****************end:后端api********************************
 
@@ -320,12 +345,16 @@ def authenticate(*, email, passwd):
 	# authenticate ok, set cookie:
 	r = web.Response()
 	r.set_cookie(COOKIR_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
-	user.passwd = '******'
+	user = masked_user(user)
 	r.content_type = 'application/json'
 	r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
 	return r
 
 
+# 隐藏口令的副本：find/findAll返回的对象在同一请求中是共用的(orm.identity_scope)，不能直接修改
+def masked_user(user):
+	return User(**dict(user, passwd='******'))
+
 # 计算加密cookie
 def user2cookie(user, max_age):
 	# build cookie string by: id-expires-sha1
@@ -354,7 +383,7 @@ def cookie2user(cookie_str):
 		if sha1 != hashlib.sha1(s.encode('utf-8')).hexdigest():
 			logging.info('invalid sha1')
 			return None
-		user.passwd = '******'
+		return masked_user(user)
 	except Exception as e:
 		logging.exception(e)
 		return None
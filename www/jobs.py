@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# name: 后台任务
+
+'''
+修正冗余数据的后台任务，可由cron定期执行
+
+    python3 jobs.py reconcile_comments        重新统计每篇日志的评论数，修正blogs.comment_count
+    python3 jobs.py propagate_user <user_id>  把用户的name/image同步到他的日志和评论(user_name/user_image)
+'''
+
+import sys
+import asyncio
+import logging
+
+import orm
+from config import configs
+
+
+# 按主键分批遍历日志，统计这一批日志的评论数，与comment_count不同的改为统计值
+# 只在comment_count读取后没有被修改过时才更新，避免覆盖并发的增减，没有更新的下次再修正
+#     @return 修正的日志数
+@asyncio.coroutine
+def reconcile_comments(batch_size=500):
+    fixed = 0
+    last = ''
+    while True:
+        blogs = yield from orm.select('select `id`, `comment_count` from `blogs` where `id` > ? order by `id` limit ?', [last, batch_size])
+        if not blogs:
+            break
+        last = blogs[-1]['id']
+        ids = [b['id'] for b in blogs]
+        rs = yield from orm.select('select `blog_id` _id_, count(`id`) _num_ from `comments` where `blog_id` in (%s) group by `blog_id`' % ', '.join(['?'] * len(ids)), ids)
+        counts = dict((r['_id_'], r['_num_']) for r in rs)
+        for b in blogs:
+            n = counts.get(b['id'], 0)
+            if b['comment_count'] == n:
+                continue
+            if b['comment_count'] is None:
+                rows = yield from orm.execute('update `blogs` set `comment_count`=? where `id`=? and `comment_count` is null', [n, b['id']])
+            else:
+                rows = yield from orm.execute('update `blogs` set `comment_count`=? where `id`=? and `comment_count`=?', [n, b['id'], b['comment_count']])
+            if rows:
+                logging.info('fixed comment_count of blog %s: %s => %s' % (b['id'], b['comment_count'], n))
+                fixed += 1
+    return fixed
+
+
+# 复制了用户名和头像的表
+USER_COPIES = ('blogs', 'comments')
+
+# 把用户当前的name/image写入日志和评论，User.update修改name或image后在后台执行
+# 按主键分批：每批取batch_size条该用户的记录，只更新值不同的，每批之间暂停pause秒，避免长时间占用表和连接
+# 每批都重新读取用户，连续改名时以最后一次为准
+#     @return 更新的记录数
+@asyncio.coroutine
+def propagate_user(user_id, batch_size=200, pause=0.05):
+    updated = 0
+    for table in USER_COPIES:
+        last = ''
+        while True:
+            # 从主库读，避免从库延迟读到改名前的值
+            with orm.use_primary():
+                users = yield from orm.select('select `name`, `image` from `users` where `id`=?', [user_id], 1)
+            if not users:
+                return updated
+            name, image = users[0]['name'], users[0]['image']
+            rs = yield from orm.select('select `id`, `user_name`, `user_image` from `%s` where `user_id`=? and `id` > ? order by `id` limit ?' % table, [user_id, last, batch_size])
+            if not rs:
+                break
+            last = rs[-1]['id']
+            ids = [r['id'] for r in rs if r['user_name'] != name or r['user_image'] != image]
+            if ids:
+                updated += yield from orm.execute('update `%s` set `user_name`=?, `user_image`=? where `id` in (%s)' % (
+                    table, ', '.join(['?'] * len(ids))), [name, image] + ids)
+            if len(rs) < batch_size:
+                break
+            yield from asyncio.sleep(pause)
+    logging.info('propagated user %s to %s row(s)' % (user_id, updated))
+    return updated
+
+
+JOBS = dict(reconcile_comments=reconcile_comments, propagate_user=propagate_user)
+
+
+@asyncio.coroutine
+def main(loop, argv):
+    if not argv or argv[0] not in JOBS:
+        print(__doc__)
+        return
+    yield from orm.create_pool(loop=loop, **configs.db)
+    try:
+        result = yield from JOBS[argv[0]](*argv[1:])
+        print('%s: %s' % (argv[0], result))
+    finally:
+        yield from orm.close_pool()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, sys.argv[1:]))
@@ -4,6 +4,8 @@
 
 import time
 import uuid
+import asyncio
+import collections
 
 # ***********
 # uuid:不可变对象UUID（UUID类）和函数uuid1()、uuid3()、uuid4()和uuid5()
@@ -14,7 +16,9 @@ import uuid
 # hex：指定32个字符以创建UUID对象，当指定一个32个字符构成的字符串来创建一个UUID对象时，花括号、连字符和URN前缀等都是可选的；
 # ***********
 
-from orm import Model, StringField, BooleanField, FloatField, TextField
+import orm
+import jobs
+from orm import Model, StringField, BooleanField, IntegerField, FloatField, TextField
 
 
 def next_id():
@@ -25,37 +29,64 @@ class User(Model):
     __table__ = 'users'
 
     id = StringField(primary_key=True, default=next_id,  ddl='varchar(50)')
-    email = StringField(ddl='varchar(50)')
+    email = StringField(ddl='varchar(50)', unique=True)
     passwd = StringField(ddl='varchar(50)')
     admin = BooleanField()
     name = StringField(ddl='varchar(50)')
     image = StringField(ddl='varchar(500)')
-    create_at = FloatField(default=time.time)
+    create_at = FloatField(default=time.time, index=True)
+
+    # 改名或换头像后，提交时在后台同步日志和评论中复制的user_name/user_image
+    @classmethod
+    @asyncio.coroutine
+    def on_update(cls, user, names):
+        if 'name' in names or 'image' in names:
+            uid = user.id
+            orm.after_commit(lambda: orm.spawn(jobs.propagate_user(uid)))
 
 
 class Blog(Model):
     __table__ = 'blogs'
+    # 首页和日志列表的查询结果缓存
+    __cache__ = dict(ttl=10, maxsize=256)
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
-    user_id = StringField(ddl='varchar(50)')
+    user_id = StringField(ddl='varchar(50)', index=True)
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
-    content = TextField()
-    create_at = FloatField(default=time.time)
+    content = TextField(deferred=True)
+    # 评论数，插入、删除评论时增减(Comment.on_insert/on_remove)，jobs.py reconcile_comments修正
+    comment_count = IntegerField()
+    create_at = FloatField(default=time.time, index=True)
 
 
 class Comment(Model):
     __table__ = 'comments'
+    # 日志详情页按blog_id取评论并按create_at分页
+    __indexes__ = [('blog_id', 'create_at')]
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     blog_id = StringField(ddl='varchar(50)')
-    user_id = StringField(ddl='varchar(50)')
+    user_id = StringField(ddl='varchar(50)', index=True)
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
     content = TextField()
-    create_at = FloatField(default=time.time)
+    # 创建评论时生成的HTML，显示时不用再转换
+    html_content = TextField()
+    create_at = FloatField(default=time.time, index=True)
+
+    @classmethod
+    @asyncio.coroutine
+    def on_insert(cls, comments):
+        yield from Blog.increment('comment_count', collections.Counter(c.get('blog_id') for c in comments))
+
+    @classmethod
+    @asyncio.coroutine
+    def on_remove(cls, comments):
+        counts = collections.Counter(c.get('blog_id') for c in comments)
+        yield from Blog.increment('comment_count', dict((k, -n) for k, n in counts.items()))
 
 # *********************
 # 1、日期和时间用float类型存储在数据库中，而不是datetime类型，
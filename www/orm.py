@@ -2,23 +2,97 @@
 # -*- coding: utf-8 -*-
 # name: 编写ORM---操作数据库
 
+import re
+import time
 import asyncio
 import logging
+import contextlib
+import itertools
+import contextvars
+import collections
 
-import aiomysql
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+import sqlitepool
+from apis import Page, decode_cursor
 
 def log(sql, args=()):
-    logging.info('SQL: %s' % sql)
+    logging.debug('SQL: %s', sql)
+
+# 数据库后端：'mysql'(aiomysql)或'sqlite'(sqlitepool，单机部署和测试时不需要MySQL服务器)
+# 由create_pool(backend=...)选择，默认为mysql
+_dialect = 'mysql'
+_backend = aiomysql
+_placeholder = '%s'
+
+
+def dialect():
+    return _dialect
+
+# SQL语句的占位符是?，而MySQL的占位符是%s；SQLite的占位符就是?，不需要替换
+def _compile(sql):
+    if _placeholder == '?':
+        return sql
+    return sql.replace('?', _placeholder)
 
 # 创建连接池
 # 连接池由全局变量__pool存储，缺省情况下将编码设置为utf8，自动提交事务
+# 读写分离：replicas=[dict(host=...), ...]为每个从库创建一个连接池(未指定的参数同主库)
+#     SELECT按balance('round_robin'或'least_outstanding')分发到从库，INSERT/UPDATE/DELETE走主库
+#     需要读到刚写入的数据时，用 with orm.use_primary(): 强制从主库读
 
 
 @asyncio.coroutine
 def create_pool(loop, **kw):
     logging.info('create database connection pool...')
-    global __pool
-    __pool = yield from aiomysql.create_pool(
+    _use_backend(kw.get('backend', 'mysql'))
+    primary = yield from _create_pool(loop, kw)
+    replicas = []
+    for r in kw.get('replicas', ()):
+        logging.info('create replica connection pool: %s' % r.get('host', kw.get('host', 'localhost')))
+        replicas.append((yield from _create_pool(loop, dict(kw, **r))))
+    set_pools(primary, replicas, kw.get('balance', 'round_robin'))
+    if 'saturation_threshold' in kw:
+        global saturation_threshold
+        saturation_threshold = kw['saturation_threshold']
+    if 'slow_query_threshold' in kw:
+        global slow_query_threshold
+        slow_query_threshold = kw['slow_query_threshold']
+    if 'request_connection' in kw:
+        global request_connection
+        request_connection = kw['request_connection']
+    for table in kw.get('write_behind', ()):
+        if table not in _models:
+            raise ValueError('Invalid write_behind table: %s' % table)
+        enable_write_behind(_models[table])
+
+
+# 关闭连接池：先写入write-behind队列中所有未保存的记录
+@asyncio.coroutine
+def close_pool():
+    logging.info('close database connection pool...')
+    for model in list(_models.values()):
+        if model.__write_behind__ is not None:
+            yield from model.__write_behind__.close()
+    for pool in [__pool] + __replicas:
+        pool.close()
+        yield from pool.wait_closed()
+
+
+@asyncio.coroutine
+def _create_pool(loop, kw):
+    if _dialect == 'sqlite':
+        # SQLite：db为数据库文件的路径
+        return (yield from sqlitepool.create_pool(
+            kw.get('path', kw['db']),
+            minsize=kw.get('minsize', 1),
+            maxsize=kw.get('maxsize', 10),
+            loop=loop
+        ))
+    return (yield from aiomysql.create_pool(
         host=kw.get('host', 'localhost'),
         port=kw.get('port', 3306),
         user=kw['user'],
@@ -29,7 +103,64 @@ def create_pool(loop, **kw):
         maxsize=kw.get('maxsize', 10),
         minsize=kw.get('minsize', 1),
         loop=loop
-    )
+    ))
+
+
+# 切换数据库后端，重新编译所有Model的语句
+def _use_backend(backend):
+    global _dialect, _backend, _placeholder, _RE_ARGS
+    if backend == 'sqlite':
+        _backend, _placeholder = sqlitepool, '?'
+    elif backend == 'mysql':
+        if aiomysql is None:
+            raise RuntimeError('aiomysql is required by mysql backend.')
+        _backend, _placeholder = aiomysql, '%s'
+    else:
+        raise ValueError('Invalid backend: %s' % backend)
+    _dialect = backend
+    _RE_ARGS = re.compile(r'\((?:%s, )*%s\)' % (re.escape(_placeholder), re.escape(_placeholder)))
+    _normalized.clear()
+    _tables.clear()
+    del _labels[:]
+    for model in _models.values():
+        _prepare(model)
+
+
+# 设置主库和从库的连接池，也可以传入自己实现的连接池(如测试用的假连接池)
+def set_pools(primary, replicas=(), balance='round_robin'):
+    global __pool, __replicas, __balance, __next_replica
+    if balance not in ('round_robin', 'least_outstanding'):
+        raise ValueError('Invalid balance: %s' % balance)
+    __pool = primary
+    __replicas = list(replicas)
+    __balance = balance
+    __next_replica = itertools.cycle(__replicas)
+    _pool_stats.clear()
+    _pool_stats[primary] = PoolStats('primary')
+    for n, r in enumerate(__replicas):
+        _pool_stats[r] = PoolStats('replica%s' % n)
+
+__replicas = []
+_primary_only = contextvars.ContextVar('orm_primary_only', default=False)
+
+
+@contextlib.contextmanager
+def use_primary():
+    'read from the primary pool within the scope, e.g. right after save() or update().'
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+# 选择执行SELECT的连接池
+def _read_pool():
+    if not __replicas or _primary_only.get():
+        return __pool
+    if __balance == 'least_outstanding':
+        return min(__replicas, key=lambda p: _pool_stats[p].outstanding)
+    return next(__next_replica)
 # ****************************************
 # dict.get(key, default=None)
 # 返回指定键的值，如果值不在字典中返回默认值。
@@ -46,20 +177,238 @@ def create_pool(loop, **kw):
 # 注意要始终坚持使用带参数的SQL，而不是自己拼接SQL字符串，这样可以防止SQL注入攻击。
 @asyncio.coroutine
 def select(sql, args, size=None):
+    # SQL语句的占位符是?，而MySQL的占位符是%s, 因此要替换
+    return (yield from _select(_compile(sql), args, size))
+
+# 连接池监控：取连接的等待时间、查询耗时、使用中/空闲连接数
+# 等待取连接的协程数超过saturation_threshold时记录日志并通知saturation_listeners中的回调
+#     orm.saturation_listeners.append(lambda name, stats: ...)
+# orm.pool_stats()返回各连接池的快照
+saturation_threshold = 5
+saturation_listeners = []
+
+
+class PoolStats(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.waiting = 0
+        self.max_waiting = 0
+        self.outstanding = 0
+        self.saturations = 0
+        self.acquires = 0
+        self.acquire_time = 0.0
+        self.max_acquire_time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.max_query_time = 0.0
+
+    def snapshot(self, pool):
+        size = getattr(pool, 'size', 0)
+        free = getattr(pool, 'freesize', 0)
+        return dict(
+            maxsize=getattr(pool, 'maxsize', None),
+            size=size,
+            in_use=size - free,
+            free=free,
+            waiting=self.waiting,
+            max_waiting=self.max_waiting,
+            outstanding=self.outstanding,
+            saturations=self.saturations,
+            acquires=self.acquires,
+            avg_acquire_time=self.acquire_time / self.acquires if self.acquires else 0.0,
+            max_acquire_time=self.max_acquire_time,
+            queries=self.queries,
+            avg_query_time=self.query_time / self.queries if self.queries else 0.0,
+            max_query_time=self.max_query_time)
+
+
+# 连接池 ==> PoolStats
+_pool_stats = dict()
+
+
+def pool_stats():
+    'return a snapshot of every pool: wait/query latency, in-use/free connections and saturation count.'
+    return dict((stats.name, stats.snapshot(pool)) for pool, stats in _pool_stats.items())
+
+
+# 从连接池取连接并记录等待时间
+@asyncio.coroutine
+def _acquire(pool):
+    stats = _pool_stats[pool]
+    stats.waiting += 1
+    stats.max_waiting = max(stats.max_waiting, stats.waiting)
+    if stats.waiting == saturation_threshold + 1:
+        stats.saturations += 1
+        logging.warning('pool %s saturated: %s waiting, %s' % (stats.name, stats.waiting, stats.snapshot(pool)))
+        for callback in saturation_listeners:
+            try:
+                callback(stats.name, stats.snapshot(pool))
+            except Exception as e:
+                logging.exception(e)
+    start = time.time()
+    try:
+        ctx = yield from pool
+    finally:
+        stats.waiting -= 1
+    elapsed = time.time() - start
+    stats.acquires += 1
+    stats.acquire_time += elapsed
+    stats.max_acquire_time = max(stats.max_acquire_time, elapsed)
+    return ctx
+
+
+# 执行语句并记录耗时
+@asyncio.coroutine
+def _timed(pool, run, conn, sql, args, *extra):
+    stats = _pool_stats[pool]
+    stats.outstanding += 1
+    start = time.time()
+    try:
+        return (yield from run(conn, sql, args, *extra))
+    finally:
+        stats.outstanding -= 1
+        _record(stats, sql, args, time.time() - start)
+
+
+def _record(stats, sql, args, elapsed):
+    stats.queries += 1
+    stats.query_time += elapsed
+    stats.max_query_time = max(stats.max_query_time, elapsed)
+    _profile(sql, args, elapsed)
+
+
+# 查询分析：按归一化后的语句(如'Blog.__select__ where ...')统计次数、耗时和p50/p95/p99
+# 耗时超过slow_query_threshold(秒)的语句写入慢查询日志'orm.slow'，参数只记录类型
+# orm.query_report()输出报告，orm.reset_query_stats()清空统计
+slow_query_threshold = 0.5
+_slow_log = logging.getLogger('orm.slow')
+
+
+class StatementStats(object):
+
+    def __init__(self, samples=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        # 只保留最近的samples次耗时用于计算百分位
+        self.samples = collections.deque(maxlen=samples)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.samples.append(elapsed)
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def summary(self):
+        return dict(count=self.count, total=self.total, avg=self.total / self.count if self.count else 0.0,
+                    max=self.max, slow=self.slow,
+                    p50=self.percentile(50), p95=self.percentile(95), p99=self.percentile(99))
+
+
+# 归一化语句 ==> StatementStats
+_statement_stats = dict()
+# 已编译语句 ==> 归一化语句
+_normalized = dict()
+# (语句前缀, 名称)，如(Blog.__select__, 'Blog.__select__')，由ModelMetaclass登记，长的在前
+_labels = []
+_RE_ARGS = re.compile(r'\((?:%s, )*%s\)')
+_RE_ROWS = re.compile(r'\(\.\.\.\)(?:, \(\.\.\.\))+')
+
+
+def _normalize(sql):
+    try:
+        return _normalized[sql]
+    except KeyError:
+        pass
+    label = sql
+    for prefix, name in _labels:
+        if sql.startswith(prefix):
+            label = name + sql[len(prefix):]
+            break
+    label = _RE_ROWS.sub('(...), ...', _RE_ARGS.sub('(...)', label))
+    if len(_normalized) < 4096:
+        _normalized[sql] = label
+    return label
+
+
+def _label(sql, name):
+    _labels.append((_compile(sql), name))
+    _labels.sort(key=lambda l: len(l[0]), reverse=True)
+
+
+def _redact(args):
+    if args and len(args) > 10:
+        return '[%s args]' % len(args)
+    return '[%s]' % ', '.join('<%s>' % type(a).__name__ for a in (args or ()))
+
+
+def _profile(sql, args, elapsed):
+    label = _normalize(sql)
+    stats = _statement_stats.get(label)
+    if stats is None:
+        stats = _statement_stats[label] = StatementStats()
+    stats.add(elapsed)
+    if elapsed >= slow_query_threshold:
+        stats.slow += 1
+        _slow_log.warning('slow query: %.3fs %s args=%s', elapsed, label, _redact(args))
+
+
+def query_stats():
+    'return count/avg/max/p50/p95/p99 of every normalized statement.'
+    return dict((label, stats.summary()) for label, stats in _statement_stats.items())
+
+
+def query_report(top=20):
+    'return a text report of the statements taking the most total time.'
+    rows = sorted(query_stats().items(), key=lambda i: i[1]['total'], reverse=True)[:top]
+    lines = ['%8s %10s %9s %9s %9s %9s %6s  %s' % ('count', 'total(ms)', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'max(ms)', 'slow', 'statement')]
+    for label, s in rows:
+        lines.append('%8d %10.1f %9.2f %9.2f %9.2f %9.2f %6d  %s' % (
+            s['count'], s['total'] * 1000, s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000, s['max'] * 1000, s['slow'], label))
+    return '\n'.join(lines)
+
+
+def reset_query_stats():
+    _statement_stats.clear()
+
+# 执行已编译(占位符为%s)的SELECT语句, Model内部直接调用，省去替换占位符
+# 在transaction()或connection_scope()中时使用绑定的连接，否则从连接池取连接
+@asyncio.coroutine
+def _select(sql, args, size=None, cursor=None):
     log(sql, args)
-    global __pool
-    with (yield from __pool) as conn:
-        # DictCursor:指定返回的类型为dict(字典)
-        cur = yield from conn.cursor(aiomysql.DictCursor)
-        # SQL语句的占位符是?，而MySQL的占位符是%s, 因此要替换
-        yield from cur.execute(sql.replace('?', '%s'), args or ())
-        if size:
-            rs = yield from cur.fetchmany(size)
-        else:
-            rs = yield from cur.fetchall()
-        yield from cur.close()
-        logging.info('rows returned: %s' % len(rs))
-        return rs
+    pinned = _bound()
+    if pinned is not None:
+        yield from pinned.lock.acquire()
+        try:
+            conn = yield from pinned.connect()
+            return (yield from _timed(pinned.pool, _fetch, conn, sql, args, size, cursor))
+        finally:
+            pinned.lock.release()
+    pool = _read_pool()
+    with (yield from _acquire(pool)) as conn:
+        return (yield from _timed(pool, _fetch, conn, sql, args, size, cursor))
+
+
+@asyncio.coroutine
+def _fetch(conn, sql, args, size, cursor=None):
+    # DictCursor:指定返回的类型为dict(字典)；cursor为_backend.Cursor时返回tuple
+    cur = yield from conn.cursor(cursor or _backend.DictCursor)
+    yield from cur.execute(sql, args or ())
+    if size:
+        rs = yield from cur.fetchmany(size)
+    else:
+        rs = yield from cur.fetchall()
+    yield from cur.close()
+    logging.debug('rows returned: %s', len(rs))
+    return rs
 
 # 执行INSERT、UPDATE、DELETE语句
 #     @return 影响的行数
@@ -67,20 +416,648 @@ def select(sql, args, size=None):
 
 @asyncio.coroutine
 def execute(sql, args, autocommit=True):
+    sql = _compile(sql)
+    try:
+        return (yield from _execute(sql, args, autocommit))
+    finally:
+        # insert/delete无法得知增减了多少条记录，下次count()时重新统计；update不改变记录数
+        if not _RE_UPDATE.match(sql):
+            _stale_count(_written_table(sql))
+
+# 执行已编译的INSERT、UPDATE、DELETE语句
+# autocommit=False时单独开启一个事务；在transaction()中时由外层事务提交
+@asyncio.coroutine
+def _execute(sql, args, autocommit=True):
     log(sql)
-    with (yield from __pool) as conn:
-        if not autocommit:
-            yield from conn.begin()
+    table = _written_table(sql)
+    pinned = _bound()
+    # 请求绑定的连接上autocommit=False的语句由_execute_many在该连接上开始事务
+    if pinned is not None and (pinned.transaction or autocommit):
+        yield from pinned.lock.acquire()
         try:
-            cur = yield from conn.cursor()
-            yield from cur.execute(sql.replace('?', '%s'), args)
-            affected = cur.rowcount
-            yield from cur.close()
-        except BaseException as e:
-            if not autocommit:
-                yield from conn.rollbRack()
-            raise
-        return affected
+            conn = yield from pinned.connect()
+            return (yield from _timed(pinned.pool, _run, conn, sql, args))
+        finally:
+            pinned.lock.release()
+            # 事务提交时再清除一次，避免提交前被读到的旧数据留在缓存中
+            pinned.tables.add(table)
+            invalidate(table)
+            _forget(table)
+    if not autocommit:
+        return (yield from _execute_many([(sql, args)]))[0]
+    try:
+        with (yield from _acquire(__pool)) as conn:
+            return (yield from _timed(__pool, _run, conn, sql, args))
+    finally:
+        invalidate(table)
+        _forget(table)
+
+
+@asyncio.coroutine
+def _run(conn, sql, args):
+    cur = yield from conn.cursor()
+    yield from cur.execute(sql, args)
+    affected = cur.rowcount
+    yield from cur.close()
+    return affected
+
+# 在同一个连接、同一个事务中依次执行多条已编译的语句
+#     @param statements [(sql, args), ...]
+#     @return 每条语句影响的行数
+@asyncio.coroutine
+def _execute_many(statements):
+    tx = transaction()
+    yield from tx.begin()
+    try:
+        counts = []
+        for sql, args in statements:
+            counts.append((yield from _execute(sql, args)))
+    except BaseException as e:
+        yield from tx.rollback()
+        raise
+    yield from tx.commit()
+    return counts
+
+
+# 在一个事务中执行协程函数run()，返回run()的结果
+@asyncio.coroutine
+def _atomic(run):
+    tx = transaction()
+    yield from tx.begin()
+    try:
+        result = yield from run()
+    except BaseException:
+        yield from tx.rollback()
+        raise
+    yield from tx.commit()
+    return result
+
+
+# 事务：在一个连接上执行多条语句，一次提交或回滚
+#     async with orm.transaction():
+#         await comment.remove()
+#         await blog.remove()
+# 事务中的select/execute以及Model的find/save/update/remove等都使用同一个连接
+# 嵌套的transaction()加入外层事务，由最外层提交
+class Transaction(object):
+
+    def __init__(self):
+        self.conn = None
+        self._ctx = None
+        self._token = None
+        self._pinned = None
+        self._request = None
+
+    @asyncio.coroutine
+    def begin(self):
+        pinned = _bound()
+        if pinned is not None and pinned.transaction:
+            self.conn = pinned.conn
+            return self
+        if pinned is not None:
+            # 在请求绑定的连接上开始事务，事务结束前同一请求中其他协程的语句等待
+            yield from pinned.lock.acquire()
+            try:
+                self.conn = yield from pinned.connect()
+                yield from self.conn.begin()
+            except BaseException:
+                pinned.lock.release()
+                raise
+            self._request = pinned
+            pool = pinned.pool
+        else:
+            pool = _write_pool()
+            self._ctx = yield from _acquire(pool)
+            self.conn = self._ctx.__enter__()
+            try:
+                yield from self.conn.begin()
+            except BaseException:
+                self._release()
+                raise
+        self._pinned = _Pinned(pool, self.conn)
+        self._token = _connection.set(self._pinned)
+        return self
+
+    @asyncio.coroutine
+    def commit(self):
+        if self._pinned is None:
+            return
+        pinned = self._pinned
+        try:
+            yield from self.conn.commit()
+            for cls, n in pinned.counts.items():
+                cls.__count_cache__.add(n)
+        finally:
+            self._release()
+        for fn in pinned.after:
+            fn()
+
+    @asyncio.coroutine
+    def rollback(self):
+        if self._pinned is None:
+            return
+        try:
+            yield from self.conn.rollback()
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._token is not None:
+            _connection.reset(self._token)
+            self._token = None
+        ctx, self._ctx = self._ctx, None
+        if ctx is not None:
+            ctx.__exit__(None, None, None)
+        request, self._request = self._request, None
+        if request is not None:
+            request.lock.release()
+        if self._pinned is not None:
+            # 事务结束后仍在运行的协程(如事务中创建的任务)不再使用该连接
+            self._pinned.closed = True
+            for table in self._pinned.tables:
+                invalidate(table)
+                _forget(table)
+            self._pinned = None
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        return (yield from self.begin())
+
+    @asyncio.coroutine
+    def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            yield from self.commit()
+        else:
+            yield from self.rollback()
+
+
+def transaction():
+    return Transaction()
+
+
+# 绑定在当前上下文上的连接，lock保证同一时间只有一条语句在该连接上执行
+# transaction=False为connection_scope()绑定到请求的连接，第一次执行语句时才从连接池取
+class _Pinned(object):
+
+    def __init__(self, pool, conn=None, transaction=True):
+        self.pool = pool
+        self.conn = conn
+        self.transaction = transaction
+        self.closed = False
+        self.lock = asyncio.Lock()
+        # 事务中写过的表
+        self.tables = set()
+        # 事务中各Model记录数的变化，提交后再计入CountCache
+        self.counts = collections.Counter()
+        # 提交后执行的函数(after_commit)
+        self.after = []
+        self._ctx = None
+
+    @asyncio.coroutine
+    def connect(self):
+        if self.conn is None:
+            self._ctx = yield from _acquire(self.pool)
+            self.conn = self._ctx.__enter__()
+        return self.conn
+
+    # 归还连接；还有语句在执行或等待时，等它们执行完再归还
+    def close(self):
+        self.closed = True
+        if self.lock.locked():
+            asyncio.ensure_future(self._close_later())
+        else:
+            self._release()
+
+    @asyncio.coroutine
+    def _close_later(self):
+        yield from self.lock.acquire()
+        try:
+            self._release()
+        finally:
+            self.lock.release()
+
+    def _release(self):
+        ctx, self._ctx = self._ctx, None
+        self.conn = None
+        if ctx is not None:
+            ctx.__exit__(None, None, None)
+
+
+_connection = contextvars.ContextVar('orm_connection', default=None)
+
+
+# 当前上下文绑定的连接，没有或已归还时为None
+def _bound():
+    pinned = _connection.get()
+    if pinned is None or pinned.closed:
+        return None
+    return pinned
+
+
+def _in_transaction():
+    pinned = _bound()
+    return pinned is not None and pinned.transaction
+
+
+# 事务提交后再执行fn()(如启动读取已提交数据的后台任务)，回滚时不执行；不在事务中时立即执行
+def after_commit(fn):
+    if _in_transaction():
+        _connection.get().after.append(fn)
+    else:
+        fn()
+
+
+# 后台任务：在新的上下文中运行，不使用当前请求或事务绑定的连接、identity map等
+_background = set()
+
+
+def spawn(coro):
+    'run coro as a background task in an empty context.'
+    task = contextvars.Context().run(asyncio.ensure_future, coro)
+    _background.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error('background task failed: %s' % task.exception())
+
+# 按请求使用一个连接(create_pool(request_connection=True)开启)：
+# connection_scope()中所有语句使用同一个主库连接，第一次执行语句时取，离开时归还
+# 读也走主库；其中的transaction()在该连接上开始事务
+request_connection = False
+
+
+@contextlib.contextmanager
+def connection_scope():
+    'bind one primary connection to the current context, acquired on first use.'
+    if not request_connection or _bound() is not None:
+        yield
+        return
+    pinned = _Pinned(_write_pool(), transaction=False)
+    token = _connection.set(pinned)
+    try:
+        yield
+    finally:
+        _connection.reset(token)
+        pinned.close()
+
+
+# 返回主库连接池(类中无法直接引用__pool)
+def _write_pool():
+    return __pool
+
+
+# 查询结果缓存(按Model开启)：在Model中定义 __cache__ = dict(ttl=秒, maxsize=条数)
+# 以最终的SQL和参数为key缓存查询到的记录，超过ttl失效，超过maxsize淘汰最久未使用的
+# 对表执行INSERT/UPDATE/DELETE(save、update、remove等)后清空该表的缓存
+# 事务中的查询不使用缓存
+class ResultCache(object):
+
+    def __init__(self, ttl=10, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 每次清空加一，查询期间表被修改时不缓存查到的结果
+        self.generation = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, rs, generation):
+        if generation != self.generation:
+            return
+        self._entries[key] = (time.time() + self.ttl, rs)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hits / total if total else 0.0,
+                    invalidations=self.invalidations, size=len(self._entries))
+
+
+def invalidate(table):
+    'clear the result cache of the table.'
+    model = _models.get(table)
+    if model is not None and model.__result_cache__ is not None:
+        model.__result_cache__.clear()
+
+
+def result_cache_stats():
+    'return hits/misses/hit rate of every model with result cache.'
+    return dict((table, m.__result_cache__.stats()) for table, m in _models.items() if m.__result_cache__ is not None)
+
+
+# 已编译语句 ==> 写入的表名
+_tables = dict()
+_RE_UPDATE = re.compile(r'^\s*update\s', re.I)
+_RE_TABLE = re.compile(r'^\s*(?:insert\s+(?:ignore\s+)?into|update|delete\s+from|replace\s+into)\s+`?(\w+)`?', re.I)
+
+
+def _written_table(sql):
+    try:
+        return _tables[sql]
+    except KeyError:
+        pass
+    m = _RE_TABLE.match(sql)
+    table = m.group(1) if m else None
+    if len(_tables) < 4096:
+        _tables[sql] = table
+    return table
+
+
+# 经过结果缓存的查询
+@asyncio.coroutine
+def _cached_select(cls, sql, args, size=None, cursor=None):
+    cache = cls.__result_cache__
+    if cache is None or _in_transaction():
+        return (yield from _select(sql, args, size, cursor))
+    key = (sql, tuple(args or ()), size, cursor is not None)
+    rs = cache.get(key)
+    if rs is None:
+        generation = cache.generation
+        rs = yield from _select(sql, args, size, cursor)
+        cache.put(key, rs, generation)
+    return rs
+
+# 记录数缓存：count()不再每次执行count(*)
+# save/save_many/remove/removeAll时增量维护，超过count_reconcile_interval秒后重新统计一次以修正误差
+# count(approximate=True)读取表的统计信息(information_schema.tables.table_rows)，不扫描表
+count_reconcile_interval = 300
+
+
+class CountCache(object):
+
+    def __init__(self):
+        self.value = None
+        self.loaded_at = 0
+        self.generation = 0
+
+    def get(self):
+        if self.value is None or time.time() - self.loaded_at > count_reconcile_interval:
+            return None
+        return self.value
+
+    def set(self, value, generation):
+        if generation == self.generation:
+            self.value = value
+            self.loaded_at = time.time()
+
+    def add(self, n):
+        self.generation += 1
+        if self.value is not None:
+            self.value += n
+
+    def clear(self):
+        self.generation += 1
+        self.value = None
+
+
+def _count_changed(cls, n):
+    if not n:
+        return
+    if _in_transaction():
+        _connection.get().counts[cls] += n
+    else:
+        cls.__count_cache__.add(n)
+
+
+def _stale_count(table):
+    model = _models.get(table)
+    if model is not None:
+        model.__count_cache__.clear()
+
+# write-behind：高峰时把save()放入队列后立即返回，由后台任务合并为多行insert
+# 每interval秒或攒够max_rows条时写入一次；队列最多maxsize条，满了之后save()等待(反压)
+# 关闭时close_pool()会写入队列中剩余的记录
+#     orm.enable_write_behind(Comment, max_rows=100, interval=0.05)
+# 事务中的save()不进入队列；写入失败只记录日志
+class WriteBehind(object):
+
+    def __init__(self, model, max_rows=100, interval=0.05, maxsize=10000):
+        self.model = model
+        self.max_rows = max_rows
+        self.interval = interval
+        self.queued = 0
+        self.saved = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = asyncio.Queue(maxsize)
+        self._full = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    @asyncio.coroutine
+    def put(self, obj):
+        yield from self._queue.put(obj)
+        self.queued += 1
+        if self._queue.qsize() >= self.max_rows:
+            self._full.set()
+        if not self._closing and (self._task is None or self._task.done()):
+            # 后台任务不继承当前请求的上下文(绑定的连接、identity map等)
+            self._task = spawn(self._run())
+
+    # 队列中的None表示关闭：写入它之前的所有记录后结束
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            obj = yield from self._queue.get()
+            if obj is None:
+                self._queue.task_done()
+                return
+            batch = [obj]
+            if not self._closing and self._queue.qsize() < self.max_rows - 1:
+                self._full.clear()
+                try:
+                    yield from asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            stop = False
+            while len(batch) < self.max_rows and not self._queue.empty():
+                obj = self._queue.get_nowait()
+                if obj is None:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(obj)
+            yield from self._flush(batch)
+            if stop:
+                return
+
+    @asyncio.coroutine
+    def _flush(self, batch):
+        try:
+            yield from self.model.save_many(batch, self.max_rows)
+            self.saved += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logging.exception('failed to save %s %s: %s' % (len(batch), self.model.__table__, e))
+        self.batches += 1
+        for obj in batch:
+            self._queue.task_done()
+
+    # 关闭：不取消后台任务(会丢掉它已取出的记录)，而是让它写完队列中的记录后结束
+    @asyncio.coroutine
+    def close(self):
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            self._full.set()
+            yield from self._queue.put(None)
+            yield from self._task
+        self._task = None
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.max_rows and not self._queue.empty():
+                obj = self._queue.get_nowait()
+                if obj is None:
+                    self._queue.task_done()
+                else:
+                    batch.append(obj)
+            if batch:
+                yield from self._flush(batch)
+
+    def stats(self):
+        return dict(queued=self.queued, saved=self.saved, failed=self.failed,
+                    batches=self.batches, pending=self._queue.qsize())
+
+
+def enable_write_behind(model, max_rows=100, interval=0.05, maxsize=10000):
+    'queue save() of the model and flush them as multi-row inserts.'
+    model.__write_behind__ = WriteBehind(model, max_rows, interval, maxsize)
+
+
+def write_behind_stats():
+    return dict((table, m.__write_behind__.stats()) for table, m in _models.items() if m.__write_behind__ is not None)
+
+# 按请求合并主键查询：同一轮事件循环内的所有find(pk)合并为一条where pk in (...)的查询
+# 通过loader_scope()绑定到当前请求(contextvar)，未绑定时find照常单独查询
+# 合并的查询在第一个find的上下文中执行，事务中和use_primary()中的find不合并
+class Loader(object):
+
+    def __init__(self):
+        self._pending = dict()
+        self._scheduled = False
+
+    def load(self, cls, pk):
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        self._pending.setdefault(cls, collections.OrderedDict()).setdefault(pk, []).append(fut)
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._dispatch)
+        return fut
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, dict()
+        self._scheduled = False
+        for cls, batch in pending.items():
+            asyncio.ensure_future(self._fetch(cls, batch))
+
+    @asyncio.coroutine
+    def _fetch(self, cls, batch):
+        pks = list(batch.keys())
+        try:
+            rs = yield from cls.find_many(pks)
+        except Exception as e:
+            for futs in batch.values():
+                for fut in futs:
+                    if not fut.done():
+                        fut.set_exception(e)
+            return
+        for pk, obj in zip(pks, rs):
+            for fut in batch[pk]:
+                if not fut.done():
+                    fut.set_result(obj)
+
+
+_loader = contextvars.ContextVar('orm_loader', default=None)
+
+
+@contextlib.contextmanager
+def loader_scope():
+    'bind a Loader to the current context, find() calls are coalesced within the scope.'
+    token = _loader.set(Loader())
+    try:
+        yield
+    finally:
+        _loader.reset(token)
+
+# 按请求的对象缓存(identity map)：同一请求内同一条记录(表, 主键)只对应一个Model对象
+# find/find_many/findAll返回已有的对象，不再查询或构造新的对象
+# 写入表后(包括increment、upsert、execute)丢弃该表的对象，事务结束(提交或回滚)时再丢弃一次；save/update的对象写入后重新放入
+# 只缓存包含所有列的对象，columns投影、未加载延迟列的对象和lightweight的行不缓存
+# 通过identity_scope()绑定到当前请求(contextvar)，请求结束时丢弃
+class IdentityMap(object):
+
+    def __init__(self):
+        self._objects = dict()
+        self.hits = 0
+
+    def get(self, cls, pk):
+        obj = self._objects.get((cls.__table__, pk))
+        if obj is not None:
+            self.hits += 1
+        return obj
+
+    # 已有同一记录的对象时返回已有的对象
+    def add(self, obj):
+        key = (obj.__table__, dict.get(obj, obj.__primary_key__))
+        existing = self._objects.get(key)
+        if existing is not None:
+            return existing
+        # 主键加上所有列
+        if len(obj) > len(obj.__fields__):
+            self._objects[key] = obj
+        return obj
+
+    def discard_table(self, table):
+        for key in [k for k in self._objects if k[0] == table]:
+            del self._objects[key]
+
+
+_identity = contextvars.ContextVar('orm_identity', default=None)
+
+
+# 写入表后丢弃当前请求中该表的对象，之后的查询重新读取
+def _forget(table):
+    identity = _identity.get()
+    if identity is not None:
+        identity.discard_table(table)
+
+
+# 把写入后的对象重新放入当前请求的identity map
+def _remember(obj):
+    identity = _identity.get()
+    if identity is not None:
+        identity.add(obj)
+
+
+@contextlib.contextmanager
+def identity_scope():
+    'bind an IdentityMap to the current context, the same record maps to one object within the scope.'
+    token = _identity.set(IdentityMap())
+    try:
+        yield
+    finally:
+        _identity.reset(token)
 
 # ORM
 # from orm import Model, StringField, IntegerField
@@ -90,6 +1067,92 @@ def execute(sql, args, autocommit=True):
 # StringField：字符串
 # *******************************************************
 
+# SQL语句缓存：以(where, orderBy, limit形式)等为key保存已编译的语句
+# 超过maxsize时淘汰最久未使用的语句，hits/misses用于观察缓存效果
+class SqlCache(object):
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._statements = collections.OrderedDict()
+
+    def get(self, key, build):
+        try:
+            sql = self._statements[key]
+        except KeyError:
+            self.misses += 1
+            sql = self._statements[key] = _compile(build())
+            if len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+            return sql
+        self.hits += 1
+        self._statements.move_to_end(key)
+        return sql
+
+    def clear(self):
+        self._statements.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._statements))
+
+
+# 所有Model子类, table名 ==> Model
+_models = dict()
+
+
+def sql_cache_stats():
+    'return sql cache hits/misses of every model.'
+    return dict((table, m.__sql_cache__.stats()) for table, m in _models.items())
+
+# 只读的行对象：findAll(lightweight=True)返回，用__slots__保存各列，不复制成dict
+# 支持 row.name、row['name']、row._asdict()，不能save/update/remove
+class Row(object):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def _asdict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % (k, getattr(self, k)) for k in self.__slots__))
+
+
+# 生成某个Model的行类，__init__按列的顺序直接给各个slot赋值：Row(*tuple)
+def _row_class(model_name, names):
+    body = ''.join('    self.%s = %s\n' % (k, k) for k in names)
+    namespace = dict()
+    exec('def __init__(self, %s):\n%s' % (', '.join(names), body), namespace)
+    return type('%sRow' % model_name, (Row,), dict(__slots__=tuple(names), __init__=namespace['__init__']))
+
+# 生成按names的顺序从对象中取参数的函数，直接读dict，不经过getattr
+# defaults=True时值为None的列使用Field的默认值并写回对象，默认值是否callable在生成时就确定
+def _args_function(names, mappings, defaults=True):
+    lines = ['def args(obj, _get=dict.get, _set=dict.__setitem__):']
+    namespace = dict()
+    for n, k in enumerate(names):
+        lines.append('    v%d = _get(obj, %r)' % (n, k))
+        default = mappings[k].default if defaults else None
+        if default is not None:
+            namespace['d%d' % n] = default
+            lines.append('    if v%d is None:' % n)
+            lines.append('        v%d = d%d%s' % (n, n, '()' if callable(default) else ''))
+            lines.append('        _set(obj, %r, v%d)' % (k, n))
+    lines.append('    return [%s]' % ', '.join('v%d' % n for n in range(len(names))))
+    exec('\n'.join(lines), namespace)
+    return namespace['args']
+
 # 将具体的子类如User的映射信息读取，通过metaclass：ModelMetaclass
 
 
@@ -130,16 +1193,55 @@ class ModelMetaclass(type):
         attrs['__primary_key__'] = primaryKey
         # 除主键外的属性名
         attrs['__fields__'] = fields
+        # 延迟加载的列(如大的TextField)，findAll等默认查询不取，需要时用load()取
+        attrs['__deferred__'] = [f for f in fields if mappings[f].deferred]
         # 构造默认的SELECT,INSERT,UPDATE和DELETE语句
-        attrs['__select__'] = 'select `%s`, %s from `%s`' % (
+        # __select__不包含延迟加载的列，__select_full__包含所有列(find按主键查询时使用)
+        attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ','.join(
+            '`%s`' % f for f in fields if f not in attrs['__deferred__']), tableName)
+        attrs['__select_full__'] = 'select `%s`, %s from `%s`' % (
             primaryKey, ','.join(escaped_fields), tableName)
-        attrs['__insert__'] = 'insert into `%s` (%s, `%s`) value (%s)' % (tableName, ','.join(
+        # 只读行类，按列集合缓存：(列, ...) ==> Row的子类
+        columns = (primaryKey,) + tuple(f for f in fields if f not in attrs['__deferred__'])
+        attrs['__rows__'] = {columns: _row_class(name, columns)}
+        attrs['__insert_columns__'] = '%s, `%s`' % (','.join(escaped_fields), primaryKey)
+        attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (tableName, ','.join(
             escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1))
         attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ','.join(
             map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (
             tableName, primaryKey)
-        return type.__new__(cls, name, bases, attrs)
+        # 索引：字段上的index/unique，以及Model中声明的组合索引 __indexes__ = [('blog_id', 'create_at')]
+        #     ==> [(索引名, (列, ...), 是否唯一)]
+        indexes = [((k,), v.unique) for k, v in mappings.items() if v.index and not v.primary_key]
+        indexes.extend((tuple(cols), False) for cols in attrs.get('__indexes__', ()))
+        attrs['__indexes__'] = [('idx_%s_%s' % (tableName, '_'.join(cols)), cols, unique) for cols, unique in indexes]
+        # 各语句的参数：insert为所有列加主键(使用默认值)，update为所有列加主键，delete为主键
+        attrs['__args__'] = dict(
+            insert=_args_function(fields + [primaryKey], mappings),
+            update=_args_function(fields + [primaryKey], mappings, defaults=False),
+            delete=_args_function([primaryKey], mappings, defaults=False))
+        attrs['__sql_cache__'] = SqlCache(attrs.get('__sql_cache_size__', 128))
+        attrs['__count_cache__'] = CountCache()
+        attrs['__write_behind__'] = None
+        cache = attrs.get('__cache__', None)
+        attrs['__result_cache__'] = ResultCache(**cache) if cache else None
+        model = type.__new__(cls, name, bases, attrs)
+        _prepare(model)
+        _models[tableName] = model
+        return model
+
+
+# 预先编译好驱动可直接执行的语句，findAll/findNumber的语句按需缓存
+def _prepare(model):
+    model.__sql__ = dict(
+        find=_compile('%s where `%s`=?' % (model.__select_full__, model.__primary_key__)),
+        insert=_compile(model.__insert__),
+        update=_compile(model.__update__),
+        delete=_compile(model.__delete__))
+    model.__sql_cache__.clear()
+    for k in ('__select__', '__select_full__', '__insert__', '__update__', '__delete__'):
+        _label(getattr(model, k), '%s.%s' % (model.__name__, k))
 
 # *******************************************************
 # 1、bases: 基类
@@ -156,16 +1258,42 @@ class ModelMetaclass(type):
 
 class Model(dict, metaclass=ModelMetaclass):
 
+    # 钩子：插入、删除记录后调用，与写入在同一事务中执行(用于维护计数等冗余数据)
+    # 子类定义为协程类方法，参数为插入或删除的对象列表：
+    #     @classmethod
+    #     @asyncio.coroutine
+    #     def on_insert(cls, objs): ...
+    # save/save_many/upsert/upsert_many插入的记录调用on_insert，remove调用on_remove；removeAll不调用
+    # update调用on_update(cls, obj, names)，names为更新的列
+    on_insert = None
+    on_remove = None
+    on_update = None
+
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
+        # 从数据库加载后修改过的属性，None表示不是从数据库加载的(update时写入所有已有的列)
+        object.__setattr__(self, '_dirty', None)
+
+    # 由查询到的记录构造对象，开始记录修改过的属性
+    @classmethod
+    def _from_row(cls, r):
+        obj = cls(**r)
+        object.__setattr__(obj, '_dirty', set())
+        return obj
 
     def __getattr__(self, key):
         try:
             return self[key]
         except KeyError:
+            if key in self.__mappings__:
+                raise AttributeError(r"'%s' object has not loaded '%s', use load('%s') first" % (
+                    self.__class__.__name__, key, key))
             raise AttributeError(r"'Model' object has no attribute '%s'" % key)
 
+    # 值没有变化的赋值不记为修改
     def __setattr__(self, key, value):
+        if self._dirty is not None and (key not in self or self[key] != value):
+            self._dirty.add(key)
         self[key] = value
 
     def getValue(self, key):
@@ -188,80 +1316,588 @@ class Model(dict, metaclass=ModelMetaclass):
     @asyncio.coroutine
     def find(cls, pk):
         'find object by primary key.'
-        rs = yield from select('%s where `%s`=?' % (cls.__select__, cls.__primary_key__), [pk], 1)
+        identity = _identity.get()
+        if identity is not None:
+            obj = identity.get(cls, pk)
+            if obj is not None:
+                return obj
+        # 事务中直接在事务的连接上查询，use_primary()中直接查主库，都不与其他查询合并
+        loader = _loader.get()
+        if loader is not None and not _in_transaction() and not _primary_only.get():
+            return (yield from loader.load(cls, pk))
+        rs = yield from _cached_select(cls, cls.__sql__['find'], [pk], 1)
         if len(rs) == 0:
             return None
-        return cls(**rs[0])
+        obj = cls._from_row(rs[0])
+        return identity.add(obj) if identity is not None else obj
+
+    # 根据where条件批量删除
+    #     @return 影响的行数
+    @classmethod
+    @asyncio.coroutine
+    def removeAll(cls, where, args=None):
+        'remove objects by where clause.'
+        sql = cls.__sql_cache__.get(('removeAll', where), lambda: 'delete from `%s` where %s' % (cls.__table__, where))
+        rows = yield from _execute(sql, args or [])
+        _count_changed(cls, -rows)
+        return rows
+
+    # 根据多个主键查找，一次查询；结果与pks顺序一致，不存在的主键对应None
+    @classmethod
+    @asyncio.coroutine
+    def find_many(cls, pks):
+        'find objects by primary keys.'
+        pks = list(pks)
+        found = dict()
+        identity = _identity.get()
+        if identity is not None:
+            for pk in pks:
+                obj = identity.get(cls, pk)
+                if obj is not None:
+                    found[pk] = obj
+        keys = [pk for pk in collections.OrderedDict.fromkeys(pks) if pk not in found]
+        if keys:
+            sql = cls.__sql_cache__.get(('find_many', len(keys)), lambda: '%s where `%s` in (%s)' % (
+                cls.__select_full__, cls.__primary_key__, create_args_string(len(keys))))
+            rs = yield from _cached_select(cls, sql, keys)
+            for r in rs:
+                obj = cls._from_row(r)
+                found[r[cls.__primary_key__]] = identity.add(obj) if identity is not None else obj
+        return [found.get(pk) for pk in pks]
 
     # 查找所有
+    # 除了limit offset, n的分页方式外，还支持按orderBy列的keyset(seek)分页：
+    #     after=(value, pk)  取排在(value, pk)之后的记录
+    #     before=(value, pk) 取排在(value, pk)之前的记录(结果仍按orderBy的顺序返回)
+    # keyset分页要求orderBy为单列，如'create_at desc'，主键作为第二排序列保证顺序稳定
+    # columns=[...]只查询指定的列(主键总会查询)，未指定时查询除延迟加载列以外的所有列
+    # lightweight=True返回只读的行对象(Row)，不为每条记录构造dict，适合只用来显示或输出JSON的列表
     @classmethod
     @asyncio.coroutine
     def findAll(cls, where=None, args=None, **kw):
         'find objects by where clause.'
-        sql = [cls.__select__]
-        if where:
-            sql.append('where')
-            sql.append(where)
         if args is None:
             args = []
         orderBy = kw.get('orderBy', None)
-        if orderBy:
-            sql.append('order by')
-            sql.append(orderBy)
+        columns = kw.get('columns', None)
+        if columns is not None:
+            columns = tuple(columns)
+            for c in columns:
+                if c not in cls.__mappings__:
+                    raise ValueError('Invalid column: %s' % c)
+        lightweight = kw.get('lightweight', False)
+        seek, key = None, None
+        for mode in ('after', 'before'):
+            if kw.get(mode, None) is not None:
+                seek, key = mode, kw[mode]
+        if seek:
+            if not orderBy or len(orderBy.split()) > 2 or ',' in orderBy:
+                raise ValueError('Invalid orderBy for keyset pagination: %s' % str(orderBy))
+            if not isinstance(key, (tuple, list)) or len(key) != 2:
+                raise ValueError('Invalid %s value: %s' % (seek, str(key)))
+            args.extend([key[0], key[0], key[1]])
         limit = kw.get('limit', None)
-        if limit is not None:
-            sql.append('limit')
-            if isinstance(limit, int):
-                sql.append('?')
-                args.append(limit)
-            elif isinstance(limit, tuple) and len(limit) == 2:
-                sql.append('?, ?')
-                args.extend(limit)
+        if limit is None:
+            shape = 0
+        elif isinstance(limit, int):
+            shape = 1
+            args.append(limit)
+        elif isinstance(limit, tuple) and len(limit) == 2:
+            shape = 2
+            args.extend(limit)
+        else:
+            raise ValueError('Invalid limit value: %s' % str(limit))
+
+        def build():
+            if columns is None:
+                sql = [cls.__select__]
             else:
-                raise ValueError('Invalid limit value: %s' % str(limit))
-        rs = yield from select(' '.join(sql), args)
-        return [cls(**r) for r in rs]
+                sql = ['select `%s`, %s from `%s`' % (cls.__primary_key__, ','.join(
+                    '`%s`' % c for c in columns if c != cls.__primary_key__), cls.__table__)]
+            conditions = []
+            if where:
+                conditions.append(where if not seek else '(%s)' % where)
+            order = orderBy
+            if seek:
+                column, desc = _parse_order(orderBy)
+                # before即按相反方向seek，取到后再倒序
+                if seek == 'before':
+                    desc = not desc
+                op = '<' if desc else '>'
+                conditions.append('(%s %s ? or (%s = ? and `%s` %s ?))' % (column, op, column, cls.__primary_key__, op))
+                direction = 'desc' if desc else 'asc'
+                order = '%s %s, `%s` %s' % (column, direction, cls.__primary_key__, direction)
+            if conditions:
+                sql.append('where')
+                sql.append(' and '.join(conditions))
+            if order:
+                sql.append('order by')
+                sql.append(order)
+            if shape == 1:
+                sql.append('limit ?')
+            elif shape == 2:
+                sql.append('limit ?, ?')
+            return ' '.join(sql)
+        sql = cls.__sql_cache__.get(('findAll', where, orderBy, columns, seek, shape), build)
+        if lightweight:
+            rs = yield from _cached_select(cls, sql, args, cursor=_backend.Cursor)
+            row = cls._row(columns)
+            rs = [row(*r) for r in rs]
+        else:
+            rs = [cls._from_row(r) for r in (yield from _cached_select(cls, sql, args))]
+            identity = _identity.get()
+            if identity is not None:
+                rs = [identity.add(obj) for obj in rs]
+        if seek == 'before':
+            rs.reverse()
+        return rs
+
+    # 只读行类：columns为None时是默认查询的列，否则是主键加上投影的列
+    @classmethod
+    def _row(cls, columns=None):
+        if columns is None:
+            names = (cls.__primary_key__,) + tuple(f for f in cls.__fields__ if f not in cls.__deferred__)
+        else:
+            names = (cls.__primary_key__,) + tuple(c for c in columns if c != cls.__primary_key__)
+        row = cls.__rows__.get(names)
+        if row is None:
+            row = cls.__rows__[names] = _row_class(cls.__name__, names)
+        return row
+
+    # 分页查询：总数和本页记录并发查询(各用一个连接)，返回(Page, 本页的对象)
+    # page_index为页码，cursor为Page的游标(keyset分页)，orderBy需为单列
+    @classmethod
+    @asyncio.coroutine
+    def findPage(cls, page_index=1, page_size=10, cursor=None, where=None, args=None, orderBy='create_at desc', **kw):
+        'find a page of objects with the total count.'
+        args = list(args or [])
+        column, desc = _parse_order(orderBy)
+        if cursor:
+            # 游标模式多取一条用来判断该方向上是否还有记录
+            cursor = decode_cursor(cursor)
+            direction, key = cursor
+            query = {'limit': page_size + 1, direction: key, 'orderBy': orderBy}
+        else:
+            # 与游标模式一样按(排序列, 主键)排序，排序列的值相同时页码和游标翻页的顺序一致
+            query = dict(limit=(page_size * (page_index - 1), page_size),
+                         orderBy='%s, `%s` %s' % (orderBy, cls.__primary_key__, 'desc' if desc else 'asc'))
+        if where:
+            count = cls.findNumber('count(`%s`)' % cls.__primary_key__, where, list(args))
+        else:
+            count = cls.count()
+        num, rows = yield from asyncio.gather(count, cls.findAll(where, list(args), **dict(kw, **query)))
+        p = Page(num, page_index, page_size, cursor=cursor)
+        # 页码超出范围时Page的limit为0，没有记录
+        if num == 0 or p.limit == 0:
+            return p, []
+        return p, p.paginate(rows, column, cls.__primary_key__)
+
+    # 逐批遍历大结果集：使用无缓冲的服务端游标(SSDictCursor)，每次只取chunk_size条
+    # 内存占用与表的大小无关，适合导出全部评论等场景：
+    #     async for comment in Comment.iter_all(): ...
+    # 遍历期间独占一个连接；中途break时要调用aclose()归还连接，否则要等生成器被回收：
+    #     async with contextlib.aclosing(Comment.iter_all()) as comments:
+    #         async for comment in comments: ...
+    # 在transaction()或connection_scope()中时使用绑定的连接(能读到事务中未提交的写入)，
+    # 此时按limit offset, n分批查询，每批之间释放连接，遍历时仍可在该连接上执行其他语句
+    @classmethod
+    async def iter_all(cls, where=None, args=None, chunk_size=1000, **kw):
+        'iterate objects by where clause without loading all rows.'
+        orderBy = kw.get('orderBy', None)
+        args = list(args or [])
+        pinned = _bound()
+
+        def build():
+            sql = [cls.__select__]
+            if where:
+                sql.append('where')
+                sql.append(where)
+            if pinned is not None:
+                # 分批查询时按主键保证顺序稳定
+                sql.append('order by')
+                sql.append('%s, `%s`' % (orderBy, cls.__primary_key__) if orderBy else '`%s`' % cls.__primary_key__)
+                sql.append('limit ?, ?')
+            elif orderBy:
+                sql.append('order by')
+                sql.append(orderBy)
+            return ' '.join(sql)
+        sql = cls.__sql_cache__.get(('iter_all', where, orderBy, pinned is not None), build)
+        if pinned is not None:
+            offset = 0
+            while True:
+                rs = await _select(sql, args + [offset, chunk_size])
+                for r in rs:
+                    yield cls._from_row(r)
+                if len(rs) < chunk_size:
+                    break
+                offset += chunk_size
+            return
+        log(sql, args)
+        pool = _read_pool()
+        stats = _pool_stats[pool]
+        with (await _acquire(pool)) as conn:
+            # 只计算在数据库上的时间，不含调用方处理每条记录的时间
+            elapsed = 0.0
+            stats.outstanding += 1
+            cur = await conn.cursor(_backend.SSDictCursor)
+            try:
+                start = time.time()
+                await cur.execute(sql, args)
+                elapsed += time.time() - start
+                while True:
+                    start = time.time()
+                    rs = await cur.fetchmany(chunk_size)
+                    elapsed += time.time() - start
+                    if not rs:
+                        break
+                    for r in rs:
+                        yield cls._from_row(r)
+            finally:
+                stats.outstanding -= 1
+                _record(stats, sql, args, elapsed)
+                await cur.close()
+
+    # 记录总数，结果由CountCache缓存并增量维护
+    # approximate=True时读取表的统计信息，速度快但只是估计值(仅MySQL，SQLite仍精确统计)
+    @classmethod
+    @asyncio.coroutine
+    def count(cls, approximate=False):
+        'count all objects.'
+        if approximate and _dialect == 'mysql':
+            rs = yield from _select(cls.__sql_cache__.get(('count', True), lambda: (
+                'select table_rows _num_ from information_schema.tables where table_schema = database() and table_name = ?')),
+                [cls.__table__], 1)
+            if rs and rs[0]['_num_'] is not None:
+                return rs[0]['_num_']
+        sql = cls.__sql_cache__.get(('count', False), lambda: 'select count(*) _num_ from `%s`' % cls.__table__)
+        # 事务中读到的包含未提交的写入，不读也不写缓存(提交时再计入事务中的增减)
+        if _in_transaction():
+            return (yield from _select(sql, None, 1))[0]['_num_']
+        cache = cls.__count_cache__
+        num = cache.get()
+        if num is None:
+            generation = cache.generation
+            rs = yield from _select(sql, None, 1)
+            num = rs[0]['_num_']
+            cache.set(num, generation)
+        return num
 
     # 根据number查找
     @classmethod
     @asyncio.coroutine
     def findNumber(cls, selectField, where=None, args=None):
         'find number by select and where.'
-        sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
-        if where:
-            sql.append('where')
-            sql.append(where)
-        rs = yield from select(' '.join(sql), args, 1)
+
+        def build():
+            sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
+            if where:
+                sql.append('where')
+                sql.append(where)
+            return ' '.join(sql)
+        sql = cls.__sql_cache__.get(('findNumber', selectField, where), build)
+        rs = yield from _cached_select(cls, sql, args, 1)
         if len(rs) == 0:
             return None
         return rs[0]['_num_']
 
+    # 批量保存：每batch_size个对象拼成一条多行insert，所有批次在一个事务中执行
+    #     @return 每一批影响的行数
+    @classmethod
+    @asyncio.coroutine
+    def save_many(cls, objs, batch_size=100):
+        'save objects by multi-row insert.'
+        objs = list(objs)
+        row = '(%s)' % create_args_string(len(cls.__fields__) + 1)
+        insert_args = cls.__args__['insert']
+        statements = []
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            args = []
+            for obj in batch:
+                args.extend(insert_args(obj))
+            sql = cls.__sql_cache__.get(('save_many', len(batch)), lambda: 'insert into `%s` (%s) values %s' % (
+                cls.__table__, cls.__insert_columns__, ', '.join([row] * len(batch))))
+            statements.append((sql, args))
+        if not statements:
+            return []
+        if cls.on_insert is None:
+            counts = yield from _execute_many(statements)
+        else:
+            @asyncio.coroutine
+            def run():
+                counts = yield from _execute_many(statements)
+                yield from cls.on_insert(objs)
+                return counts
+            counts = yield from _atomic(run)
+        _count_changed(cls, sum(counts))
+        for n, count in enumerate(counts):
+            if count != min(batch_size, len(objs) - n * batch_size):
+                logging.warn('failed to insert batch %s: affected rows: %s' % (n, count))
+        return counts
+
+    # 计数列原子增减：deltas为{主键: 增量}，增量相同的记录一条update ... set col = col + ?
+    #     @return 影响的行数
+    @classmethod
+    @asyncio.coroutine
+    def increment(cls, field, deltas):
+        'atomically add deltas to a numeric column.'
+        if field not in cls.__fields__:
+            raise ValueError('Invalid field: %s' % field)
+        groups = collections.defaultdict(list)
+        for pk, n in deltas.items():
+            if n:
+                groups[n].append(pk)
+        rows = 0
+        for n, pks in groups.items():
+            # 后来加上的列(schema.py check --apply)在已有记录中为NULL，按0计算
+            sql = cls.__sql_cache__.get(('increment', field, len(pks)), lambda: 'update `%s` set `%s` = coalesce(`%s`, 0) + ? where `%s` in (%s)' % (
+                cls.__table__, field, field, cls.__primary_key__, create_args_string(len(pks))))
+            rows += yield from _execute(sql, [n] + pks)
+        return rows
+
+    # 根据字段定义生成建表和建索引的DDL语句
+    @classmethod
+    def ddl(cls):
+        'return create table and create index statements.'
+        columns = []
+        for k in [cls.__primary_key__] + cls.__fields__:
+            field = cls.__mappings__[k]
+            columns.append('    `%s` %s%s' % (k, field.column_type, ' not null' if field.primary_key else ''))
+        columns.append('    primary key (`%s`)' % cls.__primary_key__)
+        statements = ['create table if not exists `%s` (\n%s\n)%s' % (
+            cls.__table__, ',\n'.join(columns), ' engine=innodb default charset=utf8' if _dialect == 'mysql' else '')]
+        for name, cols, unique in cls.__indexes__:
+            statements.append(cls.index_ddl(name, cols, unique))
+        return statements
+
+    @classmethod
+    def index_ddl(cls, name, cols, unique=False):
+        return 'create %sindex %s`%s` on `%s` (%s)' % (
+            'unique ' if unique else '', 'if not exists ' if _dialect == 'sqlite' else '', name, cls.__table__, ', '.join('`%s`' % c for c in cols))
+
+    # 插入或更新(按主键)：MySQL为insert ... on duplicate key update，SQLite为insert ... on conflict do update
+    # 更新时只写names中的列(对象中有的列)，插入时使用默认值的列(如create_at、计数列)不会被覆盖
+    @classmethod
+    def _upsert_sql(cls, n, names):
+        def build():
+            rows = ', '.join(['(%s)' % create_args_string(len(cls.__fields__) + 1)] * n)
+            if _dialect == 'sqlite':
+                if names:
+                    tail = 'on conflict(`%s`) do update set %s' % (cls.__primary_key__, ','.join(
+                        '`%s`=excluded.`%s`' % (f, f) for f in names))
+                else:
+                    tail = 'on conflict(`%s`) do nothing' % cls.__primary_key__
+            else:
+                tail = 'on duplicate key update %s' % ','.join('`%s`=values(`%s`)' % (f, f) for f in names or [cls.__primary_key__])
+            return 'insert into `%s` (%s) values %s %s' % (cls.__table__, cls.__insert_columns__, rows, tail)
+        return cls.__sql_cache__.get(('upsert', n, names), build)
+
+    # 主键以外的唯一索引(如users.email)与其他记录冲突时，MySQL的on duplicate key update会改为更新那条记录，
+    # SQLite的on conflict(主键)则报错；两者统一为事先检查，冲突时抛出ValueError
+    @classmethod
+    @asyncio.coroutine
+    def _check_unique(cls, batch):
+        for name, cols, unique in cls.__indexes__:
+            if not unique:
+                continue
+            owners = collections.OrderedDict()
+            for obj in batch:
+                key = tuple(dict.get(obj, c) for c in cols)
+                # NULL不参与唯一性比较
+                if None not in key:
+                    owners.setdefault(key, set()).add(dict.get(obj, cls.__primary_key__))
+            if not owners:
+                continue
+            sql = cls.__sql_cache__.get(('upsert_unique', name, len(owners)), lambda: 'select `%s` _pk_, %s from `%s` where %s%s' % (
+                cls.__primary_key__, ', '.join('`%s`' % c for c in cols), cls.__table__,
+                ' or '.join(['(%s)' % ' and '.join('`%s`=?' % c for c in cols)] * len(owners)),
+                ' for update' if _dialect == 'mysql' else ''))
+            args = []
+            for key in owners:
+                args.extend(key)
+            pks = set().union(*owners.values())
+            for r in (yield from _select(sql, args)):
+                key = tuple(r[c] for c in cols)
+                if key in owners:
+                    owners[key].add(r['_pk_'])
+                elif r['_pk_'] not in pks:
+                    # 数据库按排序规则比较(如MySQL不区分大小写)，取回的值与对象中的不完全相同
+                    raise ValueError('Duplicate entry %s for key %s' % (str(key), name))
+            for key, owner in owners.items():
+                if len(owner) > 1:
+                    raise ValueError('Duplicate entry %s for key %s' % (str(key), name))
+
+    # 批量插入或更新：对象中有相同列的每batch_size个对象一条语句，全部在一个事务中执行
+    # 先在事务中查出已存在的主键(MySQL加锁)，以此区分插入和更新
+    #     @return 与objs顺序一致的列表，True为插入，False为更新
+    @classmethod
+    @asyncio.coroutine
+    def upsert_many(cls, objs, batch_size=100):
+        'insert or update objects by primary key.'
+        objs = list(objs)
+        insert_args = cls.__args__['insert']
+        # 按对象中有的列分组(在填入默认值之前)
+        groups = collections.OrderedDict()
+        for n, obj in enumerate(objs):
+            groups.setdefault(tuple(f for f in cls.__fields__ if f in obj), []).append(n)
+        inserted = [False] * len(objs)
+        tx = transaction()
+        yield from tx.begin()
+        try:
+            for names, indexes in groups.items():
+                for i in range(0, len(indexes), batch_size):
+                    positions = indexes[i:i + batch_size]
+                    batch = [objs[n] for n in positions]
+                    args = []
+                    for obj in batch:
+                        args.extend(insert_args(obj))
+                    yield from cls._check_unique(batch)
+                    # 主键是每个对象参数的最后一个
+                    pks = args[len(cls.__fields__)::len(cls.__fields__) + 1]
+                    sql = cls.__sql_cache__.get(('upsert_exists', len(batch)), lambda: 'select `%s` _pk_ from `%s` where `%s` in (%s)%s' % (
+                        cls.__primary_key__, cls.__table__, cls.__primary_key__, create_args_string(len(batch)),
+                        ' for update' if _dialect == 'mysql' else ''))
+                    existing = set(r['_pk_'] for r in (yield from _select(sql, pks)))
+                    yield from _execute(cls._upsert_sql(len(batch), names), args)
+                    # 同一批中主键重复时，后面的记为更新
+                    for n, pk in zip(positions, pks):
+                        inserted[n] = pk not in existing
+                        existing.add(pk)
+            if cls.on_insert is not None:
+                yield from cls.on_insert([obj for obj, i in zip(objs, inserted) if i])
+        except BaseException as e:
+            yield from tx.rollback()
+            raise
+        yield from tx.commit()
+        for obj in objs:
+            object.__setattr__(obj, '_dirty', set())
+        _count_changed(cls, sum(inserted))
+        return inserted
+
     # *******实例方法*******
     # 调用时要加yield from， 不然仅仅是创建而没有执行
+    # 加载延迟加载或未查询的列，未指定时加载所有未加载的列
+    @asyncio.coroutine
+    def load(self, *names):
+        names = tuple(names or (f for f in self.__fields__ if f not in self))
+        if not names:
+            return self
+        cls = self.__class__
+        sql = cls.__sql_cache__.get(('load', names), lambda: 'select %s from `%s` where `%s`=?' % (
+            ','.join('`%s`' % n for n in names), cls.__table__, cls.__primary_key__))
+        rs = yield from _select(sql, [self.getValue(self.__primary_key__)], 1)
+        if len(rs) == 0:
+            logging.warn('failed to load %s: record not found' % ','.join(names))
+        else:
+            dict.update(self, rs[0])
+        return self
+
     # 保存
     @asyncio.coroutine
     def save(self):
-        args = list(map(self.getValueOrDefault, self.__fields__))
-        args.append(self.getValueOrDefault(self.__primary_key__))
-        rows = yield from execute(self.__insert__, args)
+        args = self.__args__['insert'](self)
+        if self.__write_behind__ is not None and not _in_transaction():
+            yield from self.__write_behind__.put(self)
+            return
+        sql = self.__sql__['insert']
+        if self.on_insert is None:
+            rows = yield from _execute(sql, args)
+        else:
+            @asyncio.coroutine
+            def run():
+                rows = yield from _execute(sql, args)
+                if rows == 1:
+                    yield from self.on_insert([self])
+                return rows
+            rows = yield from _atomic(run)
+        object.__setattr__(self, '_dirty', set())
+        _count_changed(self.__class__, rows)
         if rows != 1:
             logging.warn('failed to insert record: affected rows: %s' % rows)
+        elif not _in_transaction():
+            _remember(self)
+
+    # 插入或更新，一条语句完成
+    #     @return True为插入，False为更新
+    @asyncio.coroutine
+    def upsert(self):
+        if _dialect != 'mysql' or any(unique for name, cols, unique in self.__indexes__):
+            # SQLite的影响行数无法区分插入和更新；有其他唯一索引时需要先检查冲突
+            return (yield from self.upsert_many([self]))[0]
+        names = tuple(f for f in self.__fields__ if f in self)
+        args = self.__args__['insert'](self)
+        # MySQL：插入影响1行，更新影响2行，值没有变化时为0
+        sql = self._upsert_sql(1, names)
+        if self.on_insert is None:
+            rows = yield from _execute(sql, args)
+        else:
+            @asyncio.coroutine
+            def run():
+                rows = yield from _execute(sql, args)
+                if rows == 1:
+                    yield from self.on_insert([self])
+                return rows
+            rows = yield from _atomic(run)
+        object.__setattr__(self, '_dirty', set())
+        inserted = rows == 1
+        if inserted:
+            _count_changed(self.__class__, 1)
+        return inserted
 
     # 更新
     @asyncio.coroutine
     def update(self):
-        args = list(map(self.getValue, self.__fields__))
-        args.append(self.getValue(self.__primary_key__))
-        rows = yield from execute(self.__update__, args)
+        # 只更新加载后修改过的列，没有修改时不执行
+        # 不是从数据库加载的对象更新所有已有的列；未加载的列(如延迟加载的列)不更新，避免被写成NULL
+        if self._dirty is None:
+            names = [f for f in self.__fields__ if f in self]
+        else:
+            names = [f for f in self.__fields__ if f in self._dirty]
+            if not names:
+                logging.debug('nothing to update: %s' % self.getValue(self.__primary_key__))
+                return
+        if len(names) == len(self.__fields__):
+            sql = self.__sql__['update']
+            args = self.__args__['update'](self)
+        else:
+            cls = self.__class__
+            sql = cls.__sql_cache__.get(('update', tuple(names)), lambda: 'update `%s` set %s where `%s`=?' % (
+                cls.__table__, ','.join('`%s`=?' % (cls.__mappings__[f].name or f) for f in names), cls.__primary_key__))
+            args = [dict.get(self, f) for f in names]
+            args.append(dict.get(self, self.__primary_key__))
+        if self.on_update is None:
+            rows = yield from _execute(sql, args)
+        else:
+            @asyncio.coroutine
+            def run():
+                rows = yield from _execute(sql, args)
+                if rows == 1:
+                    yield from self.on_update(self, names)
+                return rows
+            rows = yield from _atomic(run)
+        object.__setattr__(self, '_dirty', set())
         if rows != 1:
             logging.warn(
                 'failed to update by primary key: affected row: %s' % rows)
+        elif not _in_transaction():
+            _remember(self)
 
     # 删除
     @asyncio.coroutine
     def remove(self):
-        args = [self.getValue(self.__primary_key__)]
-        rows = yield from execute(self.__delete__, args)
+        args = self.__args__['delete'](self)
+        sql = self.__sql__['delete']
+        if self.on_remove is None:
+            rows = yield from _execute(sql, args)
+        else:
+            @asyncio.coroutine
+            def run():
+                rows = yield from _execute(sql, args)
+                if rows == 1:
+                    yield from self.on_remove([self])
+                return rows
+            rows = yield from _atomic(run)
+        _count_changed(self.__class__, -rows)
         if rows != 1:
             logging.warn(
                 'failed to remove by primary key: affected  rows: %s' % rows)
@@ -280,11 +1916,15 @@ class Model(dict, metaclass=ModelMetaclass):
 # Field类
 class Field(object):
 
-    def __init__(self, name, column_type, primary_key, default):
+    def __init__(self, name, column_type, primary_key, default, deferred=False, index=False, unique=False):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
+        self.deferred = deferred
+        # 为该列建立(唯一)索引
+        self.index = index or unique
+        self.unique = unique
 
     def __str__(self):
         return '<%s, %s:%s>' % (self.__class__.__name__, self.column_type, self.name)
@@ -294,36 +1934,43 @@ class Field(object):
 # 字符
 class StringField(Field):
 
-    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)'):
-        super().__init__(name, ddl, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)', index=False, unique=False):
+        super().__init__(name, ddl, primary_key, default, index=index, unique=unique)
 # 布尔值
 
 
 class BooleanField(Field):
 
-    def __init__(self, name=None, default=False):
-        super().__init__(name, 'boolean', False, default)
+    def __init__(self, name=None, default=False, index=False):
+        super().__init__(name, 'boolean', False, default, index=index)
 # 整型
 
 
 class IntegerField(Field):
 
-    def __init__(self, name=None, primary_key=False, default=0):
-        super().__init__(name, 'bigint', primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0, index=False, unique=False):
+        super().__init__(name, 'bigint', primary_key, default, index=index, unique=unique)
 # 浮点型
 
 
 class FloatField(Field):
 
-    def __init__(self, name=None, primary_key=False, default=0.0):
-        super().__init__(name, 'real', primary_key, default)
-# 文本
+    def __init__(self, name=None, primary_key=False, default=0.0, index=False, unique=False):
+        super().__init__(name, 'real', primary_key, default, index=index, unique=unique)
+# 文本，deferred=True时默认查询不取该列，需要时调用load()
 
 
 class TextField(Field):
 
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'text', False, default)
+    def __init__(self, name=None, default=None, deferred=False):
+        super().__init__(name, 'text', False, default, deferred)
+
+
+# 解析单列的orderBy，如'create_at desc' ==> ('create_at', True)
+def _parse_order(orderBy):
+    parts = orderBy.split()
+    desc = len(parts) == 2 and parts[1].lower() == 'desc'
+    return parts[0], desc
 
 
 def create_args_string(num):
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# name: 数据库结构
+
+'''
+根据models中的字段声明生成建表语句，并对比数据库报告缺少的表、列和索引
+
+    python3 schema.py ddl             输出建表和建索引的语句
+    python3 schema.py check           对比数据库，报告缺少的表、列和索引
+    python3 schema.py check --apply   创建缺少的表、列和索引
+'''
+
+import sys
+import asyncio
+import logging
+
+import orm
+from models import User, Blog, Comment
+from config import configs
+
+MODELS = (User, Blog, Comment)
+
+
+# 数据库中表的列
+@asyncio.coroutine
+def live_columns(table):
+    if orm.dialect() == 'sqlite':
+        rs = yield from orm.select('pragma table_info(`%s`)' % table, [])
+        return set(r['name'] for r in rs)
+    rs = yield from orm.select('select column_name _name_ from information_schema.columns where table_schema = database() and table_name = ?', [table])
+    return set(r['_name_'] for r in rs)
+
+
+# 数据库中表的索引 ==> [((列, ...), 是否唯一)]
+@asyncio.coroutine
+def live_indexes(table):
+    if orm.dialect() == 'sqlite':
+        indexes = []
+        for index in (yield from orm.select('pragma index_list(`%s`)' % table, [])):
+            rs = yield from orm.select('pragma index_info(`%s`)' % index['name'], [])
+            cols = tuple(r['name'] for r in sorted(rs, key=lambda r: r['seqno']))
+            indexes.append((cols, bool(index['unique'])))
+        return indexes
+    rs = yield from orm.select('select index_name _index_, column_name _name_, non_unique _non_unique_ from information_schema.statistics where table_schema = database() and table_name = ? order by index_name, seq_in_index', [table])
+    indexes = dict()
+    for r in rs:
+        cols, unique = indexes.get(r['_index_'], ((), not r['_non_unique_']))
+        indexes[r['_index_']] = (cols + (r['_name_'],), unique)
+    return list(indexes.values())
+
+
+# 已有索引的前缀与声明的列相同即可使用；唯一索引要求列完全相同
+def covered(cols, unique, indexes):
+    for live, live_unique in indexes:
+        if unique and (live != cols or not live_unique):
+            continue
+        if live[:len(cols)] == cols:
+            return True
+    return False
+
+
+@asyncio.coroutine
+def check(apply=False):
+    problems = 0
+    for model in MODELS:
+        columns = yield from live_columns(model.__table__)
+        if not columns:
+            problems += 1
+            print('missing table: %s' % model.__table__)
+            if apply:
+                for sql in model.ddl():
+                    yield from orm.execute(sql, [])
+            continue
+        for k in [model.__primary_key__] + model.__fields__:
+            if k not in columns:
+                problems += 1
+                print('missing column: %s.%s (%s)' % (model.__table__, k, model.__mappings__[k].column_type))
+                if apply:
+                    yield from orm.execute('alter table `%s` add column `%s` %s' % (model.__table__, k, model.__mappings__[k].column_type), [])
+        indexes = yield from live_indexes(model.__table__)
+        for name, cols, unique in model.__indexes__:
+            if covered(cols, unique, indexes):
+                continue
+            problems += 1
+            sql = model.index_ddl(name, cols, unique)
+            print('missing index: %s' % sql)
+            if apply:
+                yield from orm.execute(sql, [])
+    print('%s problem(s) found.' % problems)
+    return problems
+
+
+@asyncio.coroutine
+def main(loop, argv):
+    if not argv or argv[0] not in ('ddl', 'check'):
+        print(__doc__)
+        return
+    if argv[0] == 'ddl':
+        for model in MODELS:
+            for sql in model.ddl():
+                print('%s;' % sql)
+        return
+    yield from orm.create_pool(loop=loop, **configs.db)
+    yield from check('--apply' in argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, sys.argv[1:]))
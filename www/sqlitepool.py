@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# name: SQLite连接池
+
+'''
+异步的SQLite连接池，接口与aiomysql相同，供orm在没有MySQL服务器时使用(单机部署、测试、压测)
+
+    pool = yield from sqlitepool.create_pool('combat.db', maxsize=10)
+    with (yield from pool) as conn:
+        cur = yield from conn.cursor(sqlitepool.DictCursor)
+        yield from cur.execute('select * from users where id=?', [uid])
+        rs = yield from cur.fetchall()
+
+sqlite3的调用都放到线程池中执行，不会阻塞事件循环；数据库使用WAL模式，读写互不阻塞
+SQL语句的占位符是?，不需要替换
+'''
+
+import asyncio
+import sqlite3
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+@asyncio.coroutine
+def create_pool(path, minsize=1, maxsize=10, loop=None, timeout=5.0, **kw):
+    pool = Pool(path, minsize, maxsize, loop or asyncio.get_event_loop(), timeout)
+    for n in range(minsize):
+        pool.release((yield from pool.acquire()))
+    return pool
+
+
+class Pool(object):
+
+    def __init__(self, path, minsize, maxsize, loop, timeout):
+        self.path = path
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self._loop = loop
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=maxsize)
+        self._free = collections.deque()
+        self._used = set()
+        self._semaphore = asyncio.Semaphore(maxsize)
+        self._closed = False
+
+    # 连接总数
+    @property
+    def size(self):
+        return len(self._free) + len(self._used)
+
+    # 空闲的连接数
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    @asyncio.coroutine
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError('Cannot acquire connection after closing pool')
+        yield from self._semaphore.acquire()
+        try:
+            if self._free:
+                conn = self._free.popleft()
+            else:
+                conn = yield from self._loop.run_in_executor(self._executor, self._connect)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._used.add(conn)
+        return conn
+
+    def _connect(self):
+        # isolation_level=None：自动提交，事务由begin()/commit()显式控制
+        db = sqlite3.connect(self.path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+        db.execute('pragma journal_mode=wal')
+        db.execute('pragma synchronous=normal')
+        return Connection(db, self._executor, self._loop)
+
+    # 事务没有结束(begin/commit/rollback被取消或出错)或还有调用在线程池中执行的连接不再使用，关闭时未提交的事务回滚
+    def release(self, conn):
+        self._used.discard(conn)
+        if self._closed or not conn._reusable():
+            conn._close()
+        else:
+            self._free.append(conn)
+        self._semaphore.release()
+
+    def close(self):
+        self._closed = True
+        while self._free:
+            self._free.popleft()._db.close()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        while self._used:
+            yield from asyncio.sleep(0.01)
+        self._executor.shutdown(wait=False)
+
+    # 支持 with (yield from pool) as conn 和 with (await pool) as conn
+    def __iter__(self):
+        conn = yield from self.acquire()
+        return _ConnectionContextManager(self, conn)
+
+    __await__ = __iter__
+
+
+class _ConnectionContextManager(object):
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._pool.release(self._conn)
+        finally:
+            self._pool = None
+            self._conn = None
+
+
+class Connection(object):
+
+    def __init__(self, db, executor, loop):
+        self._db = db
+        self._executor = executor
+        self._loop = loop
+        # 最近一次提交到线程池的调用，等待它的协程被取消后仍会执行完
+        self._pending = None
+
+    # 在线程池中执行sqlite3的调用
+    def _run(self, fn, *args):
+        self._pending = self._executor.submit(fn, *args)
+        return asyncio.wrap_future(self._pending, loop=self._loop)
+
+    def _idle(self):
+        return self._pending is None or self._pending.done()
+
+    def _reusable(self):
+        return self._idle() and not self._db.in_transaction
+
+    # 等正在执行的调用结束后再关闭
+    def _close(self):
+        if self._idle():
+            self._db.close()
+        else:
+            self._pending.add_done_callback(lambda f: self._db.close())
+
+    @asyncio.coroutine
+    def cursor(self, cursor=None):
+        return (cursor or Cursor)(self)
+
+    # 开始事务时就取得写锁，避免事务中先读后写时与其他事务冲突
+    @asyncio.coroutine
+    def begin(self):
+        yield from self._run(self._db.execute, 'begin immediate')
+
+    @asyncio.coroutine
+    def commit(self):
+        yield from self._run(self._db.commit)
+
+    @asyncio.coroutine
+    def rollback(self):
+        yield from self._run(self._db.rollback)
+
+
+class Cursor(object):
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = None
+        self.rowcount = -1
+        self.description = None
+
+    @asyncio.coroutine
+    def execute(self, sql, args=None):
+        db = self._connection._db
+
+        def run():
+            return db.execute(sql, tuple(args or ()))
+        self._cursor = yield from self._connection._run(run)
+        self.rowcount = self._cursor.rowcount
+        self.description = self._cursor.description
+        return self.rowcount
+
+    def _convert(self, rows):
+        return rows
+
+    @asyncio.coroutine
+    def fetchone(self):
+        rows = yield from self.fetchmany(1)
+        return rows[0] if rows else None
+
+    @asyncio.coroutine
+    def fetchmany(self, size=1):
+        if self._cursor is None:
+            return []
+        return self._convert((yield from self._connection._run(self._cursor.fetchmany, size)))
+
+    @asyncio.coroutine
+    def fetchall(self):
+        if self._cursor is None:
+            return []
+        return self._convert((yield from self._connection._run(self._cursor.fetchall)))
+
+    @asyncio.coroutine
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+# 返回dict(字典)的游标
+class DictCursor(Cursor):
+
+    def _convert(self, rows):
+        names = [d[0] for d in self.description or ()]
+        return [dict(zip(names, row)) for row in rows]
+
+
+# sqlite3的游标本来就是逐步从数据库取记录的，服务端游标与普通游标相同
+SSCursor = Cursor
+SSDictCursor = DictCursor